@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+import argparse, http.client, json, os, random, shutil, signal, socket, subprocess
+import sys, tempfile, threading, time
+
+SERVER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server", "server.py"
+)
+SCENARIOS = ("index", "small", "large")
+
+
+# Document tree the server is pointed at: directories with an index.wpym
+# (requested as "/dir/"), many small pages and one large binary asset.
+def generate_tree(root, pages, large_size):
+    for index in range(pages):
+        directory = os.path.join(root, f"d{index}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "index.wpym"), "w") as file:
+            file.write(f"header1('Directory {index}')\n")
+        with open(os.path.join(root, f"p{index}.wpym"), "w") as file:
+            file.write(f"meta.setTitle('Page {index}')\n")
+            for line in range(40):
+                file.write(f"paragraph('Page {index}, paragraph {line}')\n")
+    with open(os.path.join(root, "large.bin"), "wb") as file:
+        file.write(os.urandom(large_size))
+
+
+def paths(scenario, pages):
+    if scenario == "index":
+        return lambda: f"/d{random.randrange(pages)}/"
+    if scenario == "small":
+        return lambda: f"/p{random.randrange(pages)}.wpym"
+    return lambda: "/large.bin"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, root):
+    port = free_port()
+    command = [
+        sys.executable,
+        args.server,
+        "--bind",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--directory",
+        root,
+        *args.server_arg,
+    ]
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server did not start listening")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# One client thread: sends requests back to back until the deadline and
+# records the latency of every complete response, from sending the request
+# line to reading the last body byte.
+def client(port, next_path, keep_alive, headers, deadline, latencies, counters):
+    connection = None
+    while time.monotonic() < deadline:
+        if connection is None:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        start = time.perf_counter()
+        try:
+            connection.request("GET", next_path(), headers=headers)
+            response = connection.getresponse()
+            size = len(response.read())
+        except (OSError, http.client.HTTPException):
+            counters["errors"] += 1
+            connection.close()
+            connection = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        counters["bytes"] += size
+        if response.status != 200:
+            counters["errors"] += 1
+        if not keep_alive or response.will_close:
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+
+
+# Connections that make one request and then sit idle for the whole scenario,
+# like browser tabs left open. A server that gives each of them a thread
+# has fewer left for the active clients.
+def open_idle(port, count):
+    connections = []
+    for _ in range(count):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        connection.request("GET", "/d0/", headers={"Connection": "keep-alive"})
+        connection.getresponse().read()
+        connections.append(connection)
+    return connections
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_scenario(port, scenario, args):
+    headers = {"Connection": "keep-alive" if args.keep_alive else "close"}
+    if args.compressed:
+        headers["Accept-Encoding"] = "gzip"
+    counters = {"errors": 0, "bytes": 0}
+    latencies = []
+    idle = open_idle(port, args.idle)
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(
+                port,
+                paths(scenario, args.pages),
+                args.keep_alive,
+                headers,
+                deadline,
+                latencies,
+                counters,
+            ),
+        )
+        for _ in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for connection in idle:
+        connection.close()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": counters["errors"],
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "megabytes_per_second": round(counters["bytes"] / elapsed / 1e6, 2),
+        "latency_ms": (
+            {
+                name: round(percentile(latencies, fraction) * 1000, 3)
+                for name, fraction in (
+                    ("p50", 0.5),
+                    ("p95", 0.95),
+                    ("p99", 0.99),
+                    ("max", 1.0),
+                )
+            }
+            if latencies
+            else None
+        ),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Start server.py on loopback and measure throughput and latency."
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="scenario to run, may be repeated (default: all)",
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument(
+        "-d", "--duration", type=float, default=5, help="seconds per scenario"
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        dest="keep_alive",
+        action="store_false",
+        help="open a new connection for every request",
+    )
+    parser.add_argument(
+        "--idle",
+        type=int,
+        default=0,
+        help="kept-alive connections held open without requests during each scenario",
+    )
+    parser.add_argument(
+        "--compressed", action="store_true", help="send Accept-Encoding: gzip"
+    )
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--large-size", type=int, default=4 * 1024 * 1024, help="bytes")
+    parser.add_argument("--server", default=SERVER, help="server script to start")
+    parser.add_argument(
+        "--server-arg",
+        action="append",
+        default=[],
+        help="extra argument for the server, e.g. --server-arg=--processes=4",
+    )
+    parser.add_argument("-o", "--output", help="write the JSON here too")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    root = tempfile.mkdtemp(prefix="wpy-load-")
+    try:
+        generate_tree(root, args.pages, args.large_size)
+        process, port = start_server(args, root)
+        try:
+            results = {
+                "config": {
+                    "concurrency": args.concurrency,
+                    "idle": args.idle,
+                    "keep_alive": args.keep_alive,
+                    "compressed": args.compressed,
+                    "duration": args.duration,
+                    "server_args": args.server_arg,
+                },
+                "scenarios": {},
+            }
+            for scenario in args.scenario or SCENARIOS:
+                results["scenarios"][scenario] = run_scenario(port, scenario, args)
+                print(scenario, results["scenarios"][scenario], file=sys.stderr)
+        finally:
+            stop_server(process)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+import argparse, gc, json, os, statistics, sys, time, tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtCore import QCoreApplication, QEvent
+from PyQt6.QtWidgets import QApplication, QLabel, QScrollArea
+import wpy_codecache
+import wpy_document
+import wpy_net
+import wpy_watchdog
+import wpym_kit
+import wpys_engine
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+PHASES = ("markup", "mount", "layout", "scripts", "total")
+
+# name: (elements, depth, scripts, lookups)
+SCENARIOS = {
+    "flat-100": (100, 0, 0, 0),
+    "flat-400": (400, 0, 0, 0),
+    "flat-5000": (5000, 0, 0, 0),
+    "nested-100x4": (100, 4, 0, 0),
+    "nested-100x8": (100, 8, 0, 0),
+    "scripts-20": (100, 0, 20, 0),
+    "lookups-10000": (400, 0, 1, 10000),
+}
+
+
+class StubSink:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, level, text):
+        self.lines.append((level, str(text)))
+
+    def log(self, text):
+        self.write("log", text)
+
+    def warning(self, text):
+        self.write("warning", text)
+
+    def error(self, text):
+        self.write("error", text)
+
+
+# Just enough of browser.Browser for wpym_kit and wpys_engine to render a
+# page: no window, no loaders, scripts are collected instead of fetched.
+class StubBrowser:
+    watchdog = None
+
+    def __init__(self, network):
+        self.browser_structure = wpy_document.Document()
+        self.console_sink = StubSink()
+        self.code_cache = wpy_codecache.CodeCache()
+        self.network = network
+        self.website = QScrollArea()
+        self.website.setWidgetResizable(True)
+        self.website.resize(1024, 768)
+        self.navbar_title = QLabel()
+        self.web_widget = None
+        self.web_layout = None
+        self.page_cacheable = True
+        self.history = ["wpyp://bench/index.wpym"]
+        self.current_index = 0
+        self.scripts = []
+
+    def add_script(self, url):
+        self.scripts.append(url)
+
+    def load_favicon(self, url):
+        pass
+
+    def get_top_path(self, url):
+        return "wpyp://bench/"
+
+    def navigate_to_rel(self, path):
+        pass
+
+    def conv_wpy_url_to_http(self, url):
+        return "http://" + url.split("://", 1)[1]
+
+    def ask_question(self, name, question):
+        return ""
+
+    def discard(self):
+        self.website.deleteLater()
+        QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete.value)
+
+
+def generate_page(elements, depth, scripts):
+    lines = ["meta.setTitle('bench')"]
+    lines += [f"engine.addScript('s{index}.wpys')" for index in range(scripts)]
+    for index in range(elements):
+        if index % 4 == 0:
+            element = f"paragraph('paragraph {index}', id='e{index}')"
+        elif index % 4 == 1:
+            element = f"button('button {index}', id='e{index}')"
+        elif index % 4 == 2:
+            element = f"textInput('input {index}', id='e{index}')"
+        else:
+            element = f"header3('header {index}', id='e{index}')"
+        for level in range(depth):
+            if level % 2:
+                element = f"groupBox([{element}], title='g{level}')"
+            else:
+                element = f"hBox([{element}])"
+        lines.append(element)
+    return "\n".join(lines) + "\n"
+
+
+def generate_script(index, elements, lookups):
+    return (
+        f"count = 0\n"
+        f"for i in range({lookups}):\n"
+        f"    element = getId('e' + str(i % {elements}))\n"
+        f"    if element is not None:\n"
+        f"        count += 1\n"
+        f"getId('e{index % elements}').setId('e{index % elements}')\n"
+        f"log('script {index} found ' + str(count))\n"
+    )
+
+
+def render(network, page, scripts):
+    parent = StubBrowser(network)
+    mounted = []
+    mount = wpym_kit.mount
+
+    def timed_mount(*args):
+        start = time.perf_counter()
+        mount(*args)
+        mounted.append(time.perf_counter() - start)
+
+    timings = {}
+    wpym_kit.mount = timed_mount
+    try:
+        start = time.perf_counter()
+        wpym_kit.run_script(parent, "index.wpym", page)
+        timings["mount"] = mounted[0]
+        timings["markup"] = time.perf_counter() - start - timings["mount"]
+    finally:
+        wpym_kit.mount = mount
+
+    start = time.perf_counter()
+    parent.website.show()
+    QApplication.processEvents()
+    timings["layout"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for url in parent.scripts:
+        wpys_engine.run_script(parent, url.rsplit("/", 1)[1], scripts[url])
+    QApplication.processEvents()
+    timings["scripts"] = time.perf_counter() - start
+    timings["total"] = sum(timings[phase] for phase in PHASES[:-1])
+
+    errors = [text for level, text in parent.console_sink.lines if level == "error"]
+    parent.discard()
+    if errors:
+        raise RuntimeError(errors[0])
+    return timings
+
+
+def run_scenario(network, elements, depth, scripts, lookups, repeat):
+    page = generate_page(elements, depth, scripts)
+    sources = {
+        f"wpyp://bench/s{index}.wpys": generate_script(index, elements, lookups)
+        for index in range(scripts)
+    }
+
+    render(network, page, sources)
+    runs = [render(network, page, sources) for _ in range(repeat)]
+    result = {
+        phase: round(statistics.median(run[phase] for run in runs) * 1000, 3)
+        for phase in PHASES
+    }
+
+    # The smallest of a few traced runs, since the interpreter occasionally
+    # grows one of its own tables (e.g. interned strings) inside a run.
+    peaks = []
+    for _ in range(3):
+        gc.collect()
+        tracemalloc.start()
+        render(network, page, sources)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    result["peak_kib"] = round(min(peaks) / 1024, 1)
+    return result
+
+
+# A phase regresses when it is both tolerance slower (relative) and more than
+# min_ms slower than its baseline, so noise on short phases does not count.
+def compare(results, baselines, tolerance, min_ms):
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        for key, value in result.items():
+            limit = baseline.get(key)
+            if limit is None:
+                continue
+            slack = min_ms if key in PHASES else 0
+            if value > limit * (1 + tolerance) and value - limit > slack:
+                regressions.append(f"{name} {key}: {value} > {limit} (baseline)")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render synthetic pages headlessly and time each phase."
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run, may be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--custom",
+        metavar="ELEMENTS,DEPTH,SCRIPTS,LOOKUPS",
+        help="run one custom scenario instead",
+    )
+    parser.add_argument("--repeat", type=int, default=7, help="timed runs (median)")
+    parser.add_argument(
+        "--baseline",
+        default=os.path.join(BASELINES, "render.json"),
+        help="baseline file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="write the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="exit 1 if a phase regressed"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--min-ms", type=float, default=5.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    network = wpy_net.NetworkSession()
+    StubBrowser.watchdog = wpy_watchdog.Watchdog()
+
+    if args.custom:
+        scenarios = {
+            f"custom-{args.custom}": tuple(int(v) for v in args.custom.split(","))
+        }
+    else:
+        scenarios = {
+            name: SCENARIOS[name] for name in args.scenario or sorted(SCENARIOS)
+        }
+
+    results = {}
+    for name, (elements, depth, scripts, lookups) in scenarios.items():
+        results[name] = run_scenario(
+            network, elements, depth, scripts, lookups, args.repeat
+        )
+        print(name, results[name], file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+    status = 0
+    if args.check:
+        try:
+            with open(args.baseline) as file:
+                baselines = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"No usable baseline at {args.baseline}: {e}", file=sys.stderr)
+            baselines = {}
+        regressions = compare(results, baselines, args.tolerance, args.min_ms)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        status = 1 if regressions else 0
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baselines = json.load(file)
+        baselines.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+
+    network.close()
+    del app
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import argparse, json, os, statistics, sys, time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt6.QtWidgets import QApplication
+from render import StubBrowser, generate_page
+import wpy_net
+import wpy_watchdog
+import wpym_kit
+import wpys_engine
+
+# name: (script, unit count per run)
+SCENARIOS = {
+    "empty": ("pass\n", 1),
+    "lookups": (
+        "for i in range(1000):\n    getId('e' + str(i % 100)).text()\n",
+        1000,
+    ),
+    "handlers": (
+        "for i in range(1, 100, 4):\n"
+        "    getId('e' + str(i))(event='clicked')(lambda: None)\n",
+        25,
+    ),
+}
+
+
+# Time per run_script call on an already rendered page, i.e. the cost every
+# script of a page pays before and around its own code, and per unit of
+# work (lookup, handler registration) in the script.
+def run_scenario(network, script, units, scripts, repeat):
+    parent = StubBrowser(network)
+    wpym_kit.run_script(parent, "index.wpym", generate_page(100, 0, 0))
+    wpys_engine.run_script(parent, "warmup.wpys", script)
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for index in range(scripts):
+            wpys_engine.run_script(parent, f"s{index}.wpys", script)
+        runs.append((time.perf_counter() - start) / scripts)
+    errors = [text for level, text in parent.console_sink.lines if level == "error"]
+    parent.discard()
+    if errors:
+        raise RuntimeError(errors[0])
+    per_script = statistics.median(runs)
+    return {
+        "per_script_us": round(per_script * 1e6, 2),
+        "per_unit_us": round(per_script / units * 1e6, 3),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the per-script overhead of wpys_engine.run_script."
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run, may be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--scripts", type=int, default=200, help="scripts run per timed pass"
+    )
+    parser.add_argument("--repeat", type=int, default=7, help="timed passes (median)")
+    parser.add_argument("-o", "--output", help="write the JSON here too")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    network = wpy_net.NetworkSession()
+    StubBrowser.watchdog = wpy_watchdog.Watchdog()
+
+    results = {}
+    for name in args.scenario or sorted(SCENARIOS):
+        script, units = SCENARIOS[name]
+        results[name] = run_scenario(network, script, units, args.scripts, args.repeat)
+        print(name, results[name], file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
+import json
 import sys
-import requests
 from PyQt6.QtCore import QTimer
 from PyQt6.QtGui import QFont, QPixmap
 from urllib import parse as urlparse
 import wpym_kit
 import wpys_engine
+import wpys_remote
+import wpys_worker
+import wpy_codecache
+import wpy_console
+import wpy_document
+import wpy_fetch
+import wpy_favicons
+import wpy_loader
+import wpy_net
+import wpy_pagecache
+import wpy_timeline
+import wpy_watchdog
 import os
 from PyQt6.QtWidgets import (
     QApplication,
@@ -19,7 +31,8 @@ from PyQt6.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QLineEdit,
-    QTextEdit,
+    QPlainTextEdit,
+    QComboBox,
 )
 
 
@@ -52,12 +65,12 @@ class Browser(QMainWindow):
 
         if parsed.hostname.endswith(".wpyh"):
             host = parsed.hostname.removesuffix(".wpyh")
-            response = requests.get("https://gnuhobbyhub.de:8952/" + host)
+            address = self.resolver.resolve(host)
             parsed_list[0] = "wpyp"
             if not parsed.port or parsed.port == 8951:
-                parsed_list[1] = response.text + ":8950"
+                parsed_list[1] = address + ":8950"
             else:
-                parsed_list[1] = f"{response.text}:{parsed.port}"
+                parsed_list[1] = f"{address}:{parsed.port}"
             parsed = urlparse.urlparse(urlparse.urlunparse(parsed_list))
             parsed_list = list(parsed)
 
@@ -75,7 +88,7 @@ class Browser(QMainWindow):
 
         return urlparse.urlunparse(parsed_list)
 
-    def navigate_to(self, url: str = "", historize=True):
+    def navigate_to(self, url: str = "", historize=True, restore=False):
         if not url:
             url = self.navbar_bar.text()
 
@@ -85,12 +98,13 @@ class Browser(QMainWindow):
             if self.current_index != len(self.history):
                 if url != self.history[self.current_index]:
                     self.history = self.history[: self.current_index]
+                    self.page_cache.drop_from(self.current_index)
 
             if self.history[-1] != url:
                 self.history.append(url)
 
         self.navbar_bar.setText(url)
-        self.render_page(url)
+        self.render_page(url, restore=restore)
 
     def navigate_to_rel(self, path):
         if path.startswith("/"):
@@ -110,21 +124,61 @@ class Browser(QMainWindow):
     def navigate_next(self):
         if len(self.history) != self.current_index + 1:
             self.current_index += 1
-            self.navigate_to(self.history[self.current_index], historize=False)
+            self.navigate_to(
+                self.history[self.current_index], historize=False, restore=True
+            )
 
     def navigate_back(self):
         if self.current_index + 1 != 1:
             self.current_index -= 1
-            self.navigate_to(self.history[self.current_index], historize=False)
+            self.navigate_to(
+                self.history[self.current_index], historize=False, restore=True
+            )
 
     def __init__(self) -> None:
         super().__init__()
-        self.browser_structure = []
+        self.browser_structure = wpy_document.Document()
         self.scripts = []
+        self.script_results = []
+        self.script_globals = []
+        self.next_script = 0
+        self.page_cacheable = True
+        self.page_index = 0
+        self.page_cache = wpy_pagecache.PageCache()
         self.history = [""]
         self.web_widget = None
         self.web_layout = None
         self.current_index = 0
+        self.navigation = None
+        self.profile_scripts = bool(os.environ.get("WPY_PROFILE_SCRIPTS"))
+        self.watchdog = wpy_watchdog.Watchdog(
+            float(os.environ.get("WPYS_SCRIPT_BUDGET", wpy_watchdog.SCRIPT_BUDGET)),
+            float(os.environ.get("WPYS_HANDLER_BUDGET", wpy_watchdog.HANDLER_BUDGET)),
+        )
+        sys.excepthook = wpy_watchdog.excepthook
+        self.script_mode = os.environ.get("WPYS_EXECUTION", "inline")
+        self.script_pool = wpys_worker.ScriptPool()
+        self.script_host = None
+        self.network = wpy_net.NetworkSession()
+        self.resolver = wpy_net.WpyhResolver(
+            self.network,
+            registry=os.environ.get("WPYH_REGISTRY", wpy_net.REGISTRY_URL),
+            path=os.path.join(wpy_net.cache_dir(), "wpyh.json"),
+        )
+        self.fetcher = wpy_fetch.Fetcher(self.network)
+        self.call_queue = wpy_loader.CallQueue(self)
+        self.fetches = wpy_fetch.FetchGroup(self.fetcher, self.call_queue.post)
+        self.http_cache = wpy_net.HttpCache(os.path.join(wpy_net.cache_dir(), "http"))
+        self.code_cache = wpy_codecache.CodeCache(
+            os.path.join(wpy_net.cache_dir(), "code")
+        )
+        self.loader = wpy_loader.PageLoader(self.fetch_wpyp, max_threads=6, parent=self)
+        self.favicons = wpy_favicons.FaviconCache(
+            self, os.path.join(wpy_net.cache_dir(), "favicons")
+        )
+        self.favicon_loader = wpy_loader.PageLoader(
+            self.favicons.fetch, max_threads=2, parent=self
+        )
 
         self.setWindowTitle("WPY-Browser")
         self.setMinimumSize(800, 600)
@@ -146,7 +200,7 @@ class Browser(QMainWindow):
         self.nav_reload.setFixedSize(40, 30)
         self.nav_reload.setToolTip("Reload")
         self.nav_reload.clicked.connect(
-            lambda: self.render_page(self.history[self.current_index])
+            lambda: self.render_page(self.history[self.current_index], reload=True)
         )
 
         self.navbar_icon = QLabel()
@@ -156,6 +210,12 @@ class Browser(QMainWindow):
         self.navbar_bar.returnPressed.connect(self.navigate_to)
         self.toggle_console = QPushButton("Console")
         self.toggle_console.clicked.connect(self.show_console)
+        self.console_level = QComboBox()
+        self.console_level.addItems(wpy_console.LEVELS)
+        self.console_level.setToolTip("Console level")
+        self.console_level.hide()
+        self.toggle_performance = QPushButton("Performance")
+        self.toggle_performance.clicked.connect(self.show_performance)
 
         self.navbar_layout.addWidget(self.navbar_icon)
         self.navbar_layout.addWidget(self.navbar_title)
@@ -164,20 +224,31 @@ class Browser(QMainWindow):
         self.navbar_layout.addWidget(self.nav_reload)
         self.navbar_layout.addWidget(self.navbar_bar)
         self.navbar_layout.addWidget(self.toggle_console)
+        self.navbar_layout.addWidget(self.console_level)
+        self.navbar_layout.addWidget(self.toggle_performance)
 
         self.website = QScrollArea()
         self.website.setWidgetResizable(True)
         self.website.setFrameShape(QFrame.Shape.NoFrame)
 
-        self.console = QTextEdit()
+        self.console = QPlainTextEdit()
         self.console.setFont(QFont("Monospace"))
         self.console.setReadOnly(True)
         self.console.hide()
         self.console.setMaximumHeight(200)
+        self.console_sink = wpy_console.ConsoleSink(self.console)
+        self.console_level.currentTextChanged.connect(self.console_sink.set_level)
+        self.performance = wpy_timeline.TimelinePanel(self)
+        self.performance.hide()
+        self.performance.setMaximumHeight(200)
+
+        self.tools_layout = QHBoxLayout()
+        self.tools_layout.addWidget(self.console)
+        self.tools_layout.addWidget(self.performance)
 
         self.main_layout.addLayout(self.navbar_layout)
         self.main_layout.addWidget(self.website)
-        self.main_layout.addWidget(self.console)
+        self.main_layout.addLayout(self.tools_layout)
 
         self.widget.setLayout(self.main_layout)
         self.setCentralWidget(self.widget)
@@ -187,29 +258,77 @@ class Browser(QMainWindow):
             lambda: self.render_page(""),
         )
 
+    def closeEvent(self, event):
+        if self.navigation is not None:
+            self.loader.cancel(self.navigation)
+        self.close_script_host()
+        self.script_pool.close()
+        self.fetches.close()
+        self.fetcher.close()
+        self.network.close()
+        super().closeEvent(event)
+
     def error(self, text):
-        for line in text.splitlines():
-            self.console.append(
-                f'<span style="color: red">{str(line.replace(" ", "&nbsp;"))}</span>'
-            )
+        self.console_sink.error(text)
 
     def show_console(self):
         if self.console.isVisible():
             self.console.hide()
+            self.console_level.hide()
         else:
             self.console.show()
-
-    def get_wpyp(self, url: str) -> tuple[str, str]:
+            self.console_level.show()
+
+    def show_performance(self):
+        self.performance.setVisible(not self.performance.isVisible())
+
+    def fetch_page(
+        self, url: str, navigation: wpy_loader.Navigation
+    ) -> tuple[str, str, str]:
+        return self.fetch_wpyp(url, navigation, bundle=True)
+
+    # Runs on the loader threads, so errors are returned instead of being
+    # written to the console directly. With bundle, servers that support it
+    # send the page together with its scripts, which are handed to
+    # add_script through navigation.scripts.
+    def fetch_wpyp(
+        self,
+        url: str,
+        navigation: wpy_loader.Navigation | None = None,
+        bundle: bool = False,
+    ) -> tuple[str, str, str]:
         if url.startswith("file://"):
             surl = url.removeprefix("file://")
             if os.path.exists(surl):
-                return open(surl, "r").read(), url
+                return open(surl, "r").read(), url, ""
             else:
-                self.error("[WPYM-K] Failed to get file: " + url)
+                return "", "", "[WPYM-K] Failed to get file: " + url
         elif url.startswith("wpyp://") or url.startswith("wpyps://"):
+            timeline = navigation.timeline if navigation is not None else None
+            http_url = url
             try:
-                response = requests.get(self.conv_wpy_url_to_http(url), timeout=5)
+                with wpy_timeline.measure(timeline, "resolve", "network", url=url):
+                    http_url = self.conv_wpy_url_to_http(url)
+                with wpy_timeline.measure(
+                    timeline, "fetch", "network", url=http_url
+                ) as detail:
+                    response = self.http_cache.fetch(
+                        self.network,
+                        http_url,
+                        revalidate=navigation is not None and navigation.reload,
+                        cancelled=lambda: navigation is not None
+                        and navigation.cancelled,
+                        headers={"Accept": wpy_net.BUNDLE_TYPE} if bundle else None,
+                    )
+                    if response is not None:
+                        detail["status"] = response.status_code
+                        detail["from_cache"] = response.from_cache
+                        detail["size"] = len(response.content)
+                if response is None:
+                    return "", "", ""
                 if response.status_code == 200:
+                    text = response.text
+
                     purl = urlparse.urlparse(url)
                     turl = urlparse.urlparse(response.url)
                     turl_list = list(turl)
@@ -222,46 +341,207 @@ class Browser(QMainWindow):
                         turl_list[1] = purl.netloc
                     else:
                         turl_list[1] = purl.netloc
-                    return response.text, urlparse.urlunparse(turl_list)
+                    wpy_url = urlparse.urlunparse(turl_list)
+                    content_type = (response.content_type or "").partition(";")[0]
+                    if content_type.strip() == wpy_net.BUNDLE_TYPE:
+                        text = self.unpack_bundle(text, wpy_url, navigation)
+                    return text, wpy_url, ""
                 else:
-                    self.error(
-                        "[WPYM-K] Failed to get: " + self.conv_wpy_url_to_http(url)
-                    )
+                    return "", "", "[WPYM-K] Failed to get: " + http_url
             except Exception as e:
-                self.error(
-                    f"[WPYM-K] Error occured while trying to connect to: {self.conv_wpy_url_to_http(url)}. Error: {e.__class__.__name__}:{str(e)}"
+                return (
+                    "",
+                    "",
+                    f"[WPYM-K] Error occured while trying to connect to: {http_url}. Error: {e.__class__.__name__}:{str(e)}",
                 )
-        return "", ""
+        return "", "", ""
+
+    def unpack_bundle(
+        self, text: str, url: str, navigation: wpy_loader.Navigation | None
+    ) -> str:
+        bundle = json.loads(text)
+        files = bundle["files"]
+        top = self.get_top_path(url)
+        if navigation is not None:
+            for script in bundle["manifest"]["scripts"]:
+                if script in files:
+                    navigation.scripts[top + script.lstrip("/")] = files[script]
+        return files[bundle["manifest"]["page"]]
+
+    def load_favicon(self, url: str):
+        image = self.favicons.cached(self.navigation.url, url)
+        if image is not None:
+            self.navbar_icon.setPixmap(QPixmap.fromImage(image))
+            return
+
+        def favicon_loaded(result):
+            image, error = result[0], result[-1]
+            if error:
+                self.error(error)
+            if image:
+                self.navbar_icon.setPixmap(QPixmap.fromImage(image))
+
+        self.favicon_loader.load(self.navigation, url, favicon_loaded)
 
     def get_top_path(self, url: str) -> str:
         parsed_list = list(urlparse.urlparse(url))
         parsed_list[2] = "/"
         return urlparse.urlunparse(parsed_list)
 
-    def render_page(self, path: str):
-        self.console.setPlainText("")
+    def render_page(self, path: str, reload: bool = False, restore: bool = False):
+        entry = self.page_cache.take(self.current_index, path) if restore else None
+        self.park_page()
+        self.close_script_host()
+        self.fetches.close()
+        self.fetches = wpy_fetch.FetchGroup(self.fetcher, self.call_queue.post)
+        if self.navigation is not None:
+            self.loader.cancel(self.navigation)
+        self.navigation = wpy_loader.Navigation(path, reload)
+        self.page_index = self.current_index
+        self.performance.set_timeline(self.navigation.timeline)
+
+        self.console_sink.clear()
+
+        if entry is not None:
+            self.restore_page(entry)
+            self.navigation.timeline.mark("restored")
+            return
+        self.page_cache.drop(self.current_index)
 
-        s_path = os.path.split(path)
         self.navbar_title.setText("(°-°)")
         self.navbar_icon.setPixmap(QPixmap())
 
-        self.browser_structure = []
+        self.browser_structure = wpy_document.Document()
         self.scripts = []
+        self.script_results = []
+        self.script_globals = []
+        self.next_script = 0
+        self.page_cacheable = True
 
         self.web_layout = QVBoxLayout()
         self.web_widget = QWidget()
         self.web_widget.setLayout(self.web_layout)
         self.website.setWidget(self.web_widget)
 
-        wpyp = self.get_wpyp(path)
-        self.navbar_bar.setText(wpyp[1])
-        wpym_kit.run_script(self, s_path[1], wpyp[0])
-        self.web_layout.addStretch()
-        for script in self.scripts:
-            wpys_engine.run_script(
-                self, os.path.split(script)[1], self.get_wpyp(script)[0]
+        self.loader.load(self.navigation, path, self.document_loaded, self.fetch_page)
+
+    def document_loaded(self, result: tuple[str, str, str]):
+        content, url, error = result
+        if error:
+            self.error(error)
+
+        self.navbar_bar.setText(url)
+        wpym_kit.run_script(
+            self,
+            os.path.split(self.navigation.url)[1],
+            content,
+            timeline=self.navigation.timeline,
+        )
+        self.navigation.rendered = True
+        self.navigation.timeline.mark("rendered")
+        self.run_ready_scripts(self.navigation)
+
+    # Called by engine.addScript while the markup is still executing. The
+    # fetch starts right away unless the page came bundled with the script;
+    # execution waits for the markup to finish and then follows declaration
+    # order as the results arrive.
+    def add_script(self, url: str):
+        navigation = self.navigation
+        index = len(self.scripts)
+        self.scripts.append(url)
+        self.script_results.append(None)
+        if url in navigation.scripts:
+            self.script_results[index] = (navigation.scripts[url], url, "")
+            navigation.timeline.mark("bundled", {"url": url})
+            return
+
+        def script_loaded(result: tuple[str, str, str]):
+            self.script_results[index] = result
+            self.run_ready_scripts(navigation)
+
+        self.loader.load(navigation, url, script_loaded)
+
+    def run_ready_scripts(self, navigation: wpy_loader.Navigation):
+        while (
+            navigation is self.navigation
+            and navigation.rendered
+            and self.next_script < len(self.scripts)
+            and self.script_results[self.next_script] is not None
+        ):
+            script = self.scripts[self.next_script]
+            content, _, error = self.script_results[self.next_script]
+            self.script_results[self.next_script] = ()
+            self.next_script += 1
+            if error:
+                self.error(error)
+            if self.script_mode == "process":
+                if self.script_host is None:
+                    self.script_host = wpys_remote.ScriptHost(
+                        self, self.script_pool, navigation.timeline
+                    )
+                self.script_host.run(
+                    os.path.split(script)[1], content, self.profile_scripts
+                )
+                self.script_globals.append({})
+                continue
+            self.script_globals.append(
+                wpys_engine.run_script(
+                    self,
+                    os.path.split(script)[1],
+                    content,
+                    timeline=navigation.timeline,
+                    profile=self.profile_scripts,
+                )
             )
 
+    # Keeps the page that is being navigated away from alive in the page
+    # cache, unless it has not finished loading or opted out through
+    # meta.setPageCache(False).
+    def park_page(self):
+        if (
+            self.navigation is None
+            or not self.navigation.rendered
+            or self.next_script < len(self.scripts)
+            or not self.page_cacheable
+            or self.website.widget() is None
+        ):
+            return
+        self.page_cache.park(
+            self.page_index,
+            wpy_pagecache.PageEntry(
+                self.navigation.url,
+                self.website.takeWidget(),
+                self.web_layout,
+                self.browser_structure,
+                self.scripts,
+                self.script_globals,
+                self.navbar_title.text(),
+                self.navbar_icon.pixmap(),
+                self.script_host,
+            ),
+        )
+        self.script_host = None
+
+    def close_script_host(self):
+        if self.script_host is not None:
+            self.script_host.close()
+            self.script_host = None
+
+    def restore_page(self, entry: wpy_pagecache.PageEntry):
+        self.web_widget = entry.widget
+        self.web_layout = entry.layout
+        self.browser_structure = entry.structure
+        self.scripts = entry.scripts
+        self.script_results = [()] * len(entry.scripts)
+        self.script_globals = entry.script_globals
+        self.script_host = entry.host
+        self.next_script = len(entry.scripts)
+        self.page_cacheable = True
+        self.navbar_title.setText(entry.title)
+        self.navbar_icon.setPixmap(entry.icon)
+        self.website.setWidget(entry.widget)
+        self.navigation.rendered = True
+
     def ask_question(self, name, question):
         dialog = AskInputDialog(name, question)
         dialog.exec()
@@ -1,17 +1,794 @@
 #!/usr/bin/env python3
-import http.server, os, socketserver
+import argparse, ast, datetime, email.utils, functools, gzip, hashlib, http.server
+import io, json, math, os, posixpath, queue, selectors, signal, socket, stat, sys
+import threading, time, traceback, urllib.parse
+from collections import OrderedDict
+
+BUNDLE_TYPE = "application/vnd.wpy.bundle+json"
+
+# Content codings in order of preference, with the suffix of precompressed
+# sidecar files (index.wpym.gz next to index.wpym) and, where the library is
+# available, a function to compress on the fly.
+ENCODINGS = ("zstd", "br", "gzip")
+SUFFIXES = {"zstd": ".zst", "br": ".br", "gzip": ".gz"}
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, 6, mtime=0)}
+try:
+    import brotli
+
+    COMPRESSORS["br"] = brotli.compress
+except ImportError:
+    pass
+try:
+    import zstandard
+
+    COMPRESSORS["zstd"] = lambda data: zstandard.ZstdCompressor().compress(data)
+except ImportError:
+    pass
+COMPRESSIBLE = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    BUNDLE_TYPE,
+)
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+# The scripts a .wpym page loads with engine.addScript('...'), as URL paths
+# in source order. Only string literals that point into this server count;
+# anything computed at runtime is left for the browser to fetch.
+def find_scripts(source, url):
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    calls = []
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == "addScript"
+            and isinstance(node.func.value, ast.Name)
+            and node.func.value.id == "engine"
+            and len(node.args) == 1
+            and isinstance(node.args[0], ast.Constant)
+            and isinstance(node.args[0].value, str)
+        ):
+            calls.append((node.lineno, node.col_offset, node.args[0].value))
+
+    scripts = []
+    for _, _, target in sorted(calls):
+        if "://" in target:
+            continue
+        if not target.startswith("/"):
+            target = posixpath.join(posixpath.dirname(url), target)
+        if posixpath.normpath(target) == target and target not in scripts:
+            scripts.append(target)
+    return scripts
+
+
+class CachedFile:
+    def __init__(self, path, file_stat, content_type, data):
+        self.path = path
+        self.mtime_ns = file_stat.st_mtime_ns
+        self.mtime = file_stat.st_mtime
+        self.size = file_stat.st_size
+        self.content_type = content_type
+        self.data = data
+        self.etag = f'"{self.mtime_ns:x}-{self.size:x}"'
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.checked = time.monotonic()
+        self.variants = {}
+
+    def variant_etag(self, encoding):
+        if encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+
+# A .wpym page together with the scripts it adds, served as one JSON
+# document: {"manifest": {"page": url, "scripts": [url, ...]}, "files":
+# {url: text}}. parts holds the CachedFile of every constituent (None for
+# missing scripts); the bundle is valid as long as the FileCache still
+# returns exactly those.
+class Bundle(CachedFile):
+    def __init__(self, path, parts, data):
+        files = [cached for _, cached in parts if cached is not None]
+        self.path = path
+        self.parts = parts
+        self.mtime_ns = max(cached.mtime_ns for cached in files)
+        self.mtime = max(cached.mtime for cached in files)
+        self.size = len(data)
+        self.content_type = BUNDLE_TYPE
+        self.data = data
+        digest = hashlib.sha256(
+            "\0".join(
+                f"{part}{cached and cached.etag}" for part, cached in parts
+            ).encode()
+        )
+        self.etag = f'"b{digest.hexdigest()[:24]}"'
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.checked = time.monotonic()
+        self.variants = {}
+
+
+# Per-process cache of file metadata, the bytes of small files and the
+# directory index resolution. Entries are re-stat()ed at most once every
+# check_interval seconds and dropped when mtime or size changed; hot pages
+# are therefore served from memory without a syscall per request.
+class FileCache:
+    def __init__(
+        self, max_size=64 * 1024 * 1024, max_file_size=256 * 1024, check_interval=1.0
+    ):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        self.size = 0
+        self.files = OrderedDict()
+        self.missing = OrderedDict()
+        self.bundles = OrderedDict()
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, guess_type):
+        with self.lock:
+            cached = self.files.get(path)
+            if cached is not None:
+                self.files.move_to_end(path)
+                if time.monotonic() - cached.checked < self.check_interval:
+                    return cached
+            elif time.monotonic() - self.missing.get(path, -self.check_interval) < (
+                self.check_interval
+            ):
+                return None
+
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            with self.lock:
+                self.missing[path] = time.monotonic()
+                if len(self.missing) > 4096:
+                    self.missing.popitem(last=False)
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        if (
+            cached is not None
+            and cached.mtime_ns == file_stat.st_mtime_ns
+            and cached.size == file_stat.st_size
+        ):
+            cached.checked = time.monotonic()
+            return cached
+
+        data = None
+        if file_stat.st_size <= self.max_file_size:
+            try:
+                with open(path, "rb") as file:
+                    file_stat = os.fstat(file.fileno())
+                    data = file.read()
+            except OSError:
+                return None
+            if len(data) != file_stat.st_size:
+                return None
+        cached = CachedFile(path, file_stat, guess_type(path), data)
+
+        with self.lock:
+            self.missing.pop(path, None)
+            old = self.files.pop(path, None)
+            if old is not None:
+                self.size -= self.cost(old)
+            self.files[path] = cached
+            self.size += self.cost(cached)
+            self.evict()
+        return cached
+
+    # Compressed copy of a cached file, made once per encoding and dropped
+    # together with the file when it changes. None when the file is not
+    # held in memory, the encoding is unavailable or compressing does not
+    # make it smaller.
+    def compressed(self, cached, encoding):
+        if cached.data is None or encoding not in COMPRESSORS:
+            return None
+        with self.lock:
+            if encoding in cached.variants:
+                return cached.variants[encoding]
+
+        data = COMPRESSORS[encoding](cached.data)
+        if len(data) >= cached.size:
+            data = None
+        with self.lock:
+            if encoding not in cached.variants:
+                cached.variants[encoding] = data
+                if self.files.get(cached.path) is cached and data is not None:
+                    self.size += len(data)
+                    self.evict()
+            return cached.variants[encoding]
+
+    # Bundle for the page at path, served under the URL path url. Rebuilt
+    # when any constituent changed; None if the page or one of its scripts
+    # is too large to hold in memory or not UTF-8.
+    def bundle(self, path, url, translate_path, guess_type, max_bundles=64):
+        with self.lock:
+            bundle = self.bundles.get((path, url))
+            if bundle is not None:
+                self.bundles.move_to_end((path, url))
+        if bundle is not None and all(
+            self.get(part, guess_type) is cached for part, cached in bundle.parts
+        ):
+            return bundle
+
+        page = self.get(path, guess_type)
+        if page is None or page.data is None:
+            return None
+        try:
+            files = {url: page.data.decode()}
+            parts = [(path, page)]
+            scripts = find_scripts(page.data, url)
+            for script in scripts:
+                script_path = translate_path(script)
+                cached = self.get(script_path, guess_type)
+                parts.append((script_path, cached))
+                if cached is None:
+                    continue
+                if cached.data is None:
+                    return None
+                files[script] = cached.data.decode()
+        except UnicodeDecodeError:
+            return None
+        data = json.dumps(
+            {"manifest": {"page": url, "scripts": scripts}, "files": files}
+        ).encode()
+        bundle = Bundle(path, parts, data)
+
+        with self.lock:
+            self.bundles[(path, url)] = bundle
+            while len(self.bundles) > max_bundles:
+                self.bundles.popitem(last=False)
+        return bundle
+
+    def cost(self, cached):
+        if cached.data is None:
+            return 0
+        return cached.size + sum(
+            len(data) for data in cached.variants.values() if data is not None
+        )
+
+    def evict(self):
+        while self.size > self.max_size:
+            _, evicted = self.files.popitem(last=False)
+            self.size -= self.cost(evicted)
+
+    def invalidate(self, path):
+        with self.lock:
+            old = self.files.pop(path, None)
+            if old is not None:
+                self.size -= self.cost(old)
+
+    def index(self, directory):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.indexes.get(directory)
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[1]
+
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        if entry is not None and entry[0] == mtime_ns:
+            name = entry[1]
+        else:
+            name = None
+            for candidate in ("index.wpym", "index.html"):
+                if os.path.exists(os.path.join(directory, candidate)):
+                    name = candidate
+                    break
+        with self.lock:
+            self.indexes[directory] = (mtime_ns, name, now)
+        return name
 
 
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cache_control = "no-cache"
+    # timeout bounds every read of a request; idle_timeout is how long a
+    # kept-alive connection may wait for its next one, 0 closes it after
+    # each response.
+    timeout = 15
+    idle_timeout = 15
+    disable_nagle_algorithm = True
+    extensions_map = {
+        **http.server.SimpleHTTPRequestHandler.extensions_map,
+        ".wpym": "text/x-wpym; charset=utf-8",
+        ".wpys": "text/x-wpys; charset=utf-8",
+    }
+
+    def setup(self):
+        super().setup()
+        self.idle = True
+        self.keep_alive = False
+        self.server.track(self)
+
+    def finish(self):
+        if self.keep_alive:
+            return
+        self.server.untrack(self)
+        super().finish()
+
+    # One turn on a worker: serves the requests that have arrived and sets
+    # keep_alive if the connection should then wait for the next one in the
+    # server's selector, without holding the worker.
+    def handle(self):
+        self.keep_alive = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.buffered():
+            self.handle_one_request()
+        self.keep_alive = not self.close_connection
+
+    def end_headers(self):
+        if self.idle_timeout <= 0 and not self.close_connection:
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def resume(self):
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def close(self):
+        self.keep_alive = False
+        self.finish()
+
+    # Whether the next request has already arrived, completely or in part.
+    # A request that is in rfile's buffer would never make the socket
+    # readable again.
+    def buffered(self):
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        with self.server.lock:
+            self.idle = True
+
+    def parse_request(self):
+        with self.server.lock:
+            self.idle = False
+        if self.server.draining:
+            self.close_connection = True
+        return super().parse_request()
+
     def do_GET(self):
         if self.path.endswith("/"):
-            if os.path.exists(self.path[1:] + "index.wpym"):
-                self.path += "index.wpym"
-            elif os.path.exists(self.path[1:] + "index.html"):
-                self.path += "index.html"
+            index = self.server.files.index(self.translate_path(self.path))
+            if index:
+                self.path += index
 
         return super().do_GET()
 
+    # Same as SimpleHTTPRequestHandler.send_head for files, but served from
+    # the server's FileCache, and every 200 and 304 carries ETag,
+    # Last-Modified and Cache-Control so browsers can revalidate with
+    # If-None-Match or If-Modified-Since. The body is compressed when the
+    # client accepts it; each encoding has its own ETag. Pages requested
+    # with the bundle type in Accept are sent as a Bundle.
+    def send_head(self):
+        path = self.translate_path(self.path)
+        cached = None
+        if not path.endswith("/"):
+            cached = self.server.files.get(path, self.guess_type)
+        if cached is None:
+            return super().send_head()
+
+        vary = "Accept-Encoding"
+        bundle = None
+        if path.endswith(".wpym"):
+            vary = "Accept, Accept-Encoding"
+            if BUNDLE_TYPE in self.headers.get("Accept", ""):
+                url = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+                bundle = self.server.files.bundle(
+                    path, url, self.translate_path, self.guess_type
+                )
+        if bundle is not None:
+            cached = bundle
+
+        encoding, source, data = self.negotiate(path, cached, bundle is None)
+        etag = cached.variant_etag(encoding)
+        if self.not_modified(etag, cached.mtime):
+            self.send_response(http.HTTPStatus.NOT_MODIFIED)
+            self.send_header("Vary", vary)
+            self.send_validators(etag, cached.last_modified)
+            self.end_headers()
+            return None
+
+        content_type = cached.content_type
+        if source is not None:
+            path = source.path
+            cached, data = source, source.data
+        elif data is None:
+            data = cached.data
+        if data is not None:
+            body = io.BytesIO(data)
+        else:
+            try:
+                body = open(path, "rb")
+            except OSError:
+                self.server.files.invalidate(path)
+                self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+                return None
+            file_stat = os.fstat(body.fileno())
+            if (file_stat.st_mtime_ns, file_stat.st_size) != (
+                cached.mtime_ns,
+                cached.size,
+            ):
+                body.close()
+                self.server.files.invalidate(path)
+                return self.send_head()
+
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(data) if data else cached.size))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", vary)
+        self.send_validators(etag, cached.last_modified)
+        self.end_headers()
+        return body
+
+    # Picks the content coding for a file: a precompressed sidecar that is
+    # at least as new as the file wins, otherwise compressible files held
+    # in memory are compressed once and cached. Returns the encoding and
+    # either the sidecar's CachedFile or the compressed bytes.
+    def negotiate(self, path, cached, sidecars=True):
+        accepted = parse_accept_encoding(self.headers.get("Accept-Encoding", ""))
+        for encoding in ENCODINGS:
+            if accepted.get(encoding, accepted.get("*", 0)) <= 0:
+                continue
+            if sidecars:
+                source = self.server.files.get(
+                    path + SUFFIXES[encoding], self.guess_type
+                )
+                if source is not None and source.mtime_ns >= cached.mtime_ns:
+                    return encoding, source, None
+            if cached.content_type.startswith(COMPRESSIBLE):
+                data = self.server.files.compressed(cached, encoding)
+                if data is not None:
+                    return encoding, None, data
+        return None, None, None
+
+    # Files on disk go out with sendfile(2), so large assets are never
+    # copied through Python buffers.
+    def copyfile(self, source, outputfile):
+        if isinstance(source, io.BufferedReader) and hasattr(os, "sendfile"):
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+    def send_validators(self, etag, last_modified):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", self.cache_control)
+
+    def not_modified(self, etag, mtime):
+        if "If-None-Match" in self.headers:
+            tags = [tag.strip() for tag in self.headers["If-None-Match"].split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            return int(mtime) <= since.timestamp()
+        return False
+
+
+# HTTP/1.1 server that hands accepted connections to a fixed pool of worker
+# threads through a bounded queue. When the queue is full the accept loop
+# waits, so a burst of clients queues up in the listen backlog instead of
+# spawning unbounded threads. Between requests, kept-alive connections wait
+# in a selector on their own thread instead of in a worker. A connection
+# goes back to the queue when its next request arrives and is closed when it
+# stays idle for longer than the handler's idle timeout.
+class PooledHTTPServer(http.server.HTTPServer):
+    def __init__(
+        self,
+        address,
+        handler,
+        workers=16,
+        queue_size=64,
+        listener=None,
+        cache_size=64 * 1024 * 1024,
+        stat_interval=1.0,
+    ):
+        super().__init__(address, handler, bind_and_activate=listener is None)
+        if listener is not None:
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+            self.server_name = socket.getfqdn(self.server_address[0])
+            self.server_port = self.server_address[1]
+        self.connections = queue.Queue(queue_size)
+        self.handlers = set()
+        self.lock = threading.Lock()
+        self.draining = False
+        self.files = FileCache(max_size=cache_size, check_interval=stat_interval)
+        self.selector = selectors.DefaultSelector()
+        self.parked = []
+        self.wakeup, self.waker = socket.socketpair()
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        threading.Thread(target=self.watch, daemon=True).start()
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True) for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        self.connections.put((request, client_address, None))
+
+    def work(self):
+        while True:
+            item = self.connections.get()
+            if item is None:
+                return
+            request, client_address, handler = item
+            try:
+                if handler is None:
+                    handler = self.RequestHandlerClass(request, client_address, self)
+                else:
+                    handler.resume()
+                if handler.keep_alive:
+                    if self.park(handler):
+                        continue
+                    handler.close()
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    # Hands a kept-alive connection to the selector thread. Fails once the
+    # server is draining, the caller closes the connection then.
+    def park(self, handler):
+        with self.lock:
+            if self.draining:
+                return False
+            self.parked.append(handler)
+        self.waker.send(b"\0")
+        return True
+
+    # The selector thread. Idle connections are queued for a worker as soon
+    # as they are readable, which includes the client closing them.
+    def watch(self):
+        deadlines = {}
+        while True:
+            with self.lock:
+                parked, self.parked = self.parked, []
+                draining = self.draining
+            now = time.monotonic()
+            for handler in parked:
+                self.selector.register(
+                    handler.connection, selectors.EVENT_READ, handler
+                )
+                deadlines[handler] = now + handler.idle_timeout
+            for handler, deadline in list(deadlines.items()):
+                if draining or deadline <= now:
+                    self.selector.unregister(handler.connection)
+                    del deadlines[handler]
+                    handler.close()
+                    self.shutdown_request(handler.connection)
+            if draining:
+                return
+
+            timeout = min(deadlines.values(), default=math.inf) - now
+            events = self.selector.select(None if timeout == math.inf else timeout)
+            for key, _ in events:
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                del deadlines[key.data]
+                self.connections.put((key.fileobj, key.data.client_address, key.data))
+
+    def track(self, handler):
+        with self.lock:
+            self.handlers.add(handler)
+
+    def untrack(self, handler):
+        with self.lock:
+            self.handlers.discard(handler)
+
+    # Stops accepting, lets in-flight requests finish and closes connections
+    # that are waiting for their next keep-alive request.
+    def drain(self, timeout=None):
+        self.server_close()
+        with self.lock:
+            self.draining = True
+            self.waker.send(b"\0")
+            for handler in self.handlers:
+                if handler.idle:
+                    try:
+                        handler.connection.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+        for _ in self.workers:
+            self.connections.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve .wpym/.wpys pages over WPYP")
+    parser.add_argument("--bind", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8950)
+    parser.add_argument("--directory", default=os.getcwd(), help="document root")
+    parser.add_argument("--workers", type=int, default=16, help="worker threads")
+    parser.add_argument(
+        "--queue",
+        type=int,
+        default=64,
+        help="accepted connections waiting for a worker",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=float,
+        default=15,
+        help="idle keep-alive timeout in seconds, 0 to close after each response",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=15,
+        help="seconds to wait for the rest of a request",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=64,
+        help="in-memory file cache per process in MiB",
+    )
+    parser.add_argument(
+        "--stat-interval",
+        type=float,
+        default=1.0,
+        help="seconds a cached file is trusted before it is stat()ed again",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="worker processes sharing the listening socket (pre-fork mode)",
+    )
+    args = parser.parse_args(argv)
+    if args.keep_alive < 0:
+        parser.error("--keep-alive must not be negative")
+    if args.read_timeout <= 0:
+        parser.error("--read-timeout must be positive")
+    return args
+
+
+def serve(args, handler, listener=None):
+    server = PooledHTTPServer(
+        (args.bind, args.port),
+        handler,
+        workers=args.workers,
+        queue_size=args.queue,
+        listener=listener,
+        cache_size=args.cache_size * 1024 * 1024,
+        stat_interval=args.stat_interval,
+    )
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.drain(args.read_timeout)
+
+
+# Pre-fork mode. The supervisor binds the listening socket once and forks
+# worker processes that all accept on the inherited fd; the socket is
+# non-blocking so workers that lose the race for a connection go straight
+# back to waiting. Workers that die are restarted, SIGTERM is passed on to
+# every worker so they drain before the supervisor exits.
+def supervise(args, handler):
+    listener = socket.create_server(
+        (args.bind, args.port), backlog=args.queue * args.processes
+    )
+    listener.setblocking(False)
+    workers = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve(args, handler, listener)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stderr.flush()
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.processes):
+        spawn()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(
+            f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting",
+            file=sys.stderr,
+        )
+        if time.monotonic() - started < 1:
+            time.sleep(1)
+        if not stopping:
+            spawn()
+    listener.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    handler = functools.partial(CustomHTTPRequestHandler, directory=args.directory)
+    CustomHTTPRequestHandler.timeout = args.read_timeout
+    CustomHTTPRequestHandler.idle_timeout = args.keep_alive
+    if args.processes > 1:
+        supervise(args, handler)
+    else:
+        serve(args, handler)
+
 
-socket = socketserver.TCPServer(("0.0.0.0", 8950), CustomHTTPRequestHandler)
-socket.serve_forever()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import hashlib
+import importlib.util
+import marshal
+import os
+import threading
+from collections import OrderedDict
+import wpy_net
+
+
+# Compiled code objects for markup and scripts, keyed by a hash of the
+# source and the engine that runs it. A transform (like the WPYS sandbox
+# rewrite) is applied once before compiling, never on a cache hit. With a
+# path, code objects are also marshalled to disk per interpreter version.
+class CodeCache:
+    def __init__(self, path: str | None = None, max_entries: int = 128):
+        self.path = path
+        if path:
+            self.path = os.path.join(path, importlib.util.MAGIC_NUMBER.hex())
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(
+        self, source: str, engine: str, transform=None, filename: str = "<string>"
+    ):
+        key = hashlib.sha256(f"{engine}\0{filename}\0{source}".encode()).hexdigest()
+        with self._lock:
+            code = self._entries.get(key)
+            if code is not None:
+                self._entries.move_to_end(key)
+                return code
+
+        code = self._load(key)
+        if code is None:
+            if transform is not None:
+                source = transform(source)
+            code = compile(source, filename, "exec")
+            self._save(key, code)
+
+        with self._lock:
+            self._entries[key] = code
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return code
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, key: str):
+        if not self.path:
+            return None
+        try:
+            with open(os.path.join(self.path, key), "rb") as file:
+                return marshal.load(file)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def _save(self, key: str, code):
+        if not self.path:
+            return
+        try:
+            wpy_net.atomic_write(os.path.join(self.path, key), marshal.dumps(code))
+        except OSError:
+            pass
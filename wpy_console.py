@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+from collections import deque
+from PyQt6.QtCore import QEvent, QObject, QTimer
+from PyQt6.QtGui import QColor, QTextCharFormat, QTextCursor
+
+LEVELS = {"log": 0, "warning": 1, "error": 2}
+COLORS = {"log": None, "warning": "yellow", "error": "red"}
+
+
+# Console backend for log/warning/error. Lines go into a bounded ring buffer
+# and are written to the view in batches, at most once per frame, as plain
+# text. While the console is hidden nothing is drawn at all; showing it
+# redraws whatever the ring buffer still holds.
+class ConsoleSink(QObject):
+    def __init__(
+        self, view, max_lines: int = 5000, interval: int = 16, level: str = "log"
+    ):
+        super().__init__(view)
+        self.view = view
+        self.lines = deque(maxlen=max_lines)
+        self.pending = []
+        self.level = LEVELS[level]
+        self.stale = False
+        self.shown = 0
+        self.formats = {}
+        for name, color in COLORS.items():
+            text_format = QTextCharFormat()
+            if color:
+                text_format.setForeground(QColor(color))
+            self.formats[name] = text_format
+
+        view.setMaximumBlockCount(max_lines)
+        view.installEventFilter(self)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def write(self, level: str, text):
+        lines = str(text).splitlines()
+        self.lines.extend((level, line) for line in lines)
+        if LEVELS[level] < self.level:
+            return
+        if not self.view.isVisible():
+            self.stale = True
+            self.pending.clear()
+            return
+        if self.stale:
+            pass
+        elif len(self.pending) + len(lines) > self.lines.maxlen:
+            self.stale = True
+            self.pending.clear()
+        else:
+            self.pending.extend((level, line) for line in lines)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def log(self, text):
+        self.write("log", text)
+
+    def warning(self, text):
+        self.write("warning", text)
+
+    def error(self, text):
+        self.write("error", text)
+
+    def set_level(self, level: str):
+        self.level = LEVELS[level]
+        self.stale = True
+        self.flush()
+
+    def clear(self):
+        self.lines.clear()
+        self.pending.clear()
+        self.stale = False
+        self.shown = 0
+        self.view.clear()
+
+    def text(self) -> str:
+        return "\n".join(line for _, line in self.lines)
+
+    def flush(self):
+        if not self.view.isVisible():
+            return
+        if self.stale:
+            self.view.clear()
+            self.shown = 0
+            self.pending = [
+                line for line in self.lines if LEVELS[line[0]] >= self.level
+            ]
+            self.stale = False
+        if not self.pending:
+            return
+
+        cursor = QTextCursor(self.view.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.beginEditBlock()
+        for level, line in self.pending:
+            if self.shown:
+                cursor.insertBlock()
+            cursor.insertText(line, self.formats[level])
+            self.shown += 1
+        cursor.endEditBlock()
+        self.pending.clear()
+        self.view.moveCursor(QTextCursor.MoveOperation.End)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Type.Show:
+            QTimer.singleShot(0, self.flush)
+        return False
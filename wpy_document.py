@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import bisect
+import contextlib
+import traceback
+
+MAX_PASSES = 16
+# What the widget setters scripts can reach accept, as PyQt checks it.
+SETTER_TYPES = {
+    "setText": (str, type(None)),
+    "setPlaceholderText": (str, type(None)),
+    "setTitle": (str, type(None)),
+    "setDisabled": int,
+}
+
+
+# Registry of the elements created by a page, in document order. Besides
+# the plain list it keeps id -> elements and type -> elements indexes so
+# scripts can look elements up without scanning the whole page.
+class Document:
+    def __init__(self):
+        self._elements = []
+        self._ids = {}
+        self._types = {}
+        self.mutations = MutationQueue()
+        # Set by wpys_engine when the page's first script runs.
+        self.script_context = None
+
+    def __iter__(self):
+        return iter(self._elements)
+
+    def __len__(self) -> int:
+        return len(self._elements)
+
+    def __getitem__(self, index):
+        return self._elements[index]
+
+    def append(self, element: dict):
+        element["seq"] = len(self._elements)
+        self._elements.append(element)
+        self._ids.setdefault(element["id"], []).append(element)
+        self._types.setdefault(element["type"], []).append(element)
+
+    def by_id(self, id: str) -> list[dict]:
+        return self._ids.get(id, [])
+
+    def by_type(self, element_type: str) -> list[dict]:
+        return self._types.get(element_type, [])
+
+    def last_by_id(self, id: str) -> dict | None:
+        elements = self._ids.get(id)
+        return elements[-1] if elements else None
+
+    def last_by_type(self, element_type: str) -> dict | None:
+        elements = self._types.get(element_type)
+        return elements[-1] if elements else None
+
+    def set_id(self, element: dict, id: str):
+        if element["id"] == id:
+            return
+        old = self._ids[element["id"]]
+        del old[bisect.bisect_left(old, element["seq"], key=_seq)]
+        if not old:
+            del self._ids[element["id"]]
+        element["id"] = id
+        new = self._ids.setdefault(id, [])
+        new.insert(bisect.bisect_left(new, element["seq"], key=_seq), element)
+
+
+def _seq(element: dict) -> int:
+    return element["seq"]
+
+
+# Element state lives in the element's props and, while the element has a
+# widget, in the widget itself. Long pages only materialize part of the
+# document, so reads have to work with and without a widget. Writes go
+# through the document's MutationQueue.
+def get_prop(element: dict, prop: str, getter: str):
+    widget = element.get("widget")
+    if widget is not None and prop not in element.get("pending", ()):
+        return getattr(widget, getter)()
+    return element["props"][prop]
+
+
+# Writes are applied after the script that made them, so their values are
+# checked when they are queued, where a TypeError still reaches the script.
+def check_value(setter, value):
+    types = SETTER_TYPES.get(setter) if isinstance(setter, str) else None
+    if types is not None and not isinstance(value, types):
+        raise TypeError(
+            f"{setter}(): argument 1 has unexpected type '{type(value).__name__}'"
+        )
+
+
+def check_items(items) -> list[str]:
+    items = list(items)
+    for item in items:
+        if not isinstance(item, str):
+            raise TypeError(f"items must be strings, not '{type(item).__name__}'")
+    return items
+
+
+def listen(element: dict, signal: str, handler):
+    element.setdefault("handlers", []).append((signal, handler))
+    widget = element.get("widget")
+    if widget is not None:
+        getattr(widget, signal).connect(handler)
+
+
+# Writes from scripts. Props change right away, so reads see them, while
+# widgets are only updated at the end of the turn (a script run, an event
+# handler), with the last value per element and prop applied in one pass
+# and the page's updates suspended, so a loop over many elements causes one
+# relayout instead of one per write. setter is a widget method name or a
+# function taking the widget and the value.
+class MutationQueue:
+    def __init__(self):
+        self.elements = {}
+        self.depth = 0
+
+    def set(self, element: dict, prop: str, value, setter):
+        check_value(setter, value)
+        element["props"][prop] = value
+        if element.get("widget") is None:
+            return
+        element.setdefault("pending", {})[prop] = setter
+        self.elements[element["seq"]] = element
+
+    # Writes inside nested turns, e.g. a handler fired by another handler,
+    # are applied when the outermost one ends. report(text) gets the errors
+    # of writes that could not be applied.
+    @contextlib.contextmanager
+    def turn(self, widget=None, report=None):
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.flush(widget, report)
+
+    # Applying a write can fire handlers that write again; those are applied
+    # in further passes, up to MAX_PASSES, and the rest in the next turn. An
+    # element whose write fails is reported and the others still applied.
+    def flush(self, widget=None, report=None):
+        if not self.elements:
+            return
+        self.depth += 1
+        if widget is not None:
+            widget.setUpdatesEnabled(False)
+        try:
+            for _ in range(MAX_PASSES):
+                if not self.elements:
+                    break
+                elements, self.elements = self.elements, {}
+                for element in elements.values():
+                    try:
+                        _apply(element)
+                    except Exception:
+                        if report is None:
+                            raise
+                        report(
+                            f"[WPYS-E] Failed to update {element['type']} element:\n{traceback.format_exc()}\n"
+                        )
+        finally:
+            self.depth -= 1
+            if widget is not None:
+                widget.setUpdatesEnabled(True)
+
+
+def _apply(element: dict):
+    pending = element.pop("pending", None)
+    widget = element.get("widget")
+    if not pending or widget is None:
+        return
+    for prop, setter in pending.items():
+        value = element["props"][prop]
+        if isinstance(setter, str):
+            getattr(widget, setter)(value)
+        else:
+            setter(widget, value)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib import parse as urlparse
+from PyQt6.QtGui import QImage
+import wpy_net
+
+
+def origin(url: str) -> str:
+    parsed = urlparse.urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+# Favicons decoded into QImages on the loader threads. Decoded icons are kept
+# in an in-memory LRU with one entry per page origin, and the downloaded bytes
+# in a disk cache keyed by icon URL, so revisiting a site shows its icon
+# without going to the network. An origin entry remembers which icon URL it
+# holds, so a page that sets a different icon than the rest of its site
+# still gets its own.
+class FaviconCache:
+    def __init__(
+        self,
+        parent,
+        path: str | None = None,
+        max_entries: int = 64,
+        max_age: float = 7 * 24 * 3600,
+    ):
+        self.parent = parent
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, page_url: str, url: str) -> QImage | None:
+        key = origin(page_url)
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None or entry[0] != url:
+                return None
+            self._images.move_to_end(key)
+            return entry[1]
+
+    # Runs on a loader thread. Errors are returned, not reported, so the
+    # browser can report them on the GUI thread.
+    def fetch(self, url: str, navigation=None) -> tuple[QImage | None, str]:
+        page_url = navigation.url if navigation is not None else url
+        image = self.cached(page_url, url)
+        if image is not None:
+            return image, ""
+
+        data = self._load(url)
+        if data is None:
+            try:
+                response = self.parent.network.get(
+                    self.parent.conv_wpy_url_to_http(url)
+                )
+            except Exception:
+                response = None
+            if response is None or response.status_code != 200:
+                return None, "[WPYM-K] Failed to download favicon: " + url
+            data = response.content
+            self._save(url, data)
+
+        image = QImage.fromData(data)
+        if image.isNull():
+            return None, "[WPYM-K] Failed to decode favicon: " + url
+        key = origin(page_url)
+        with self._lock:
+            self._images[key] = (url, image)
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image, ""
+
+    def _file_path(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(url.encode()).hexdigest())
+
+    def _load(self, url: str) -> bytes | None:
+        if not self.path:
+            return None
+        file_path = self._file_path(url)
+        try:
+            if time.time() - os.path.getmtime(file_path) > self.max_age:
+                return None
+            with open(file_path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def _save(self, url: str, data: bytes):
+        if not self.path:
+            return
+        try:
+            wpy_net.atomic_write(self._file_path(url), data)
+        except OSError:
+            pass
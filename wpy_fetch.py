@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import collections
+import concurrent.futures
+import functools
+import json
+
+MAX_THREADS = 6
+PAGE_LIMIT = 4
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchCancelled(Exception):
+    pass
+
+
+# What fetch callbacks receive, read completely on a fetch thread. It
+# mirrors the parts of requests.Response scripts use. Streamed responses
+# have an empty body, since it went to on_chunk.
+class FetchResponse:
+    def __init__(self, response, content: bytes):
+        self.url = response.url
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.headers = dict(response.headers)
+        self.encoding = response.encoding
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Returned by fetch(). Callbacks added with then() run on the script's
+# thread once the response is complete, also when it already is.
+class FetchHandle:
+    def __init__(self, group, invoke, method: str, url: str, kwargs, on_chunk):
+        self.method = method
+        self.url = url
+        self.cancelled = False
+        self.done = False
+        self.response = None
+        self.error = None
+        self._group = group
+        self._invoke = invoke
+        self._kwargs = kwargs
+        self._on_chunk = on_chunk
+        self._callbacks = []
+
+    def then(self, on_response=None, on_error=None):
+        self._callbacks.append((on_response, on_error))
+        if self.done:
+            self._group.post(self._settle)
+        return self
+
+    def cancel(self):
+        if not self.done and not self.cancelled:
+            self.cancelled = True
+            self._group.cancelled(self)
+
+    def _settle(self):
+        callbacks, self._callbacks = self._callbacks, []
+        if self.error is None:
+            for on_response, _ in callbacks:
+                if on_response is not None:
+                    self._invoke("response", on_response, self.response)
+            return
+        handled = False
+        for _, on_error in callbacks:
+            if on_error is not None:
+                handled = True
+                self._invoke("error", on_error, self.error)
+        if callbacks and not handled:
+            self._invoke("error", _reraise, self.error)
+
+
+def _reraise(error: Exception):
+    raise error
+
+
+# Threads that run the requests of every page. Results and chunks are handed
+# to the page's post function, which runs them on the script's thread.
+class Fetcher:
+    def __init__(self, network, max_threads: int = MAX_THREADS):
+        self.network = network
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_threads, thread_name_prefix="wpys-fetch"
+        )
+
+    def submit(self, handle: FetchHandle):
+        self.executor.submit(self._run, handle)
+
+    def _run(self, handle: FetchHandle):
+        group = handle._group
+        response = error = None
+        stream = handle._on_chunk is not None
+        try:
+            if handle.cancelled:
+                raise FetchCancelled(handle.url)
+            with self.network.request(
+                handle.method, handle.url, stream=stream, **handle._kwargs
+            ) as reply:
+                content = b""
+                if stream:
+                    for chunk in reply.iter_content(CHUNK_SIZE):
+                        if handle.cancelled:
+                            raise FetchCancelled(handle.url)
+                        group.post(functools.partial(group.chunk, handle, chunk))
+                else:
+                    content = reply.content
+                response = FetchResponse(reply, content)
+        except Exception as e:
+            error = e
+        group.post(functools.partial(group.finished, handle, response, error))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# The fetches of one page. At most `limit` run at a time and the rest wait
+# in order; close() cancels all of them when the page is left. Everything
+# except the fetch threads' post calls happens on the script's thread.
+class FetchGroup:
+    def __init__(self, fetcher: Fetcher, post, limit: int = PAGE_LIMIT):
+        self.fetcher = fetcher
+        self.post = post
+        self.limit = limit
+        self.waiting = collections.deque()
+        self.running = set()
+        self.closed = False
+
+    # invoke(kind, func, *args) runs a script callback, with the page's
+    # time limit and error reporting.
+    def fetch(
+        self,
+        invoke,
+        url: str,
+        method: str = "GET",
+        on_response=None,
+        on_error=None,
+        on_chunk=None,
+        **kwargs,
+    ) -> FetchHandle:
+        kwargs.pop("stream", None)
+        handle = FetchHandle(self, invoke, method.upper(), url, kwargs, on_chunk)
+        if on_response is not None or on_error is not None:
+            handle.then(on_response, on_error)
+        if self.closed:
+            handle.cancelled = True
+            return handle
+        self.waiting.append(handle)
+        self._start()
+        return handle
+
+    def _start(self):
+        while self.waiting and len(self.running) < self.limit:
+            handle = self.waiting.popleft()
+            self.running.add(handle)
+            self.fetcher.submit(handle)
+
+    # A running fetch keeps its slot until its thread notices, at the next
+    # chunk or when the response is complete.
+    def cancelled(self, handle: FetchHandle):
+        if handle in self.waiting:
+            self.waiting.remove(handle)
+
+    def chunk(self, handle: FetchHandle, chunk: bytes):
+        if not handle.cancelled:
+            handle._invoke("chunk", handle._on_chunk, chunk)
+
+    def finished(self, handle: FetchHandle, response, error):
+        self.running.discard(handle)
+        self._start()
+        if handle.cancelled:
+            return
+        handle.done = True
+        handle.response = response
+        handle.error = error
+        handle._settle()
+
+    def close(self):
+        self.closed = True
+        for handle in list(self.waiting) + list(self.running):
+            handle.cancelled = True
+        self.waiting.clear()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import wpy_timeline
+
+
+class Navigation:
+    def __init__(self, url: str, reload: bool = False):
+        self.url = url
+        self.reload = reload
+        self.cancelled = False
+        self.rendered = False
+        self.scripts = {}
+        self.timeline = wpy_timeline.Timeline(url)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _FetchTask(QRunnable):
+    def __init__(self, loader, navigation: Navigation, url: str, callback, fetch):
+        super().__init__()
+        self.loader = loader
+        self.navigation = navigation
+        self.url = url
+        self.callback = callback
+        self.fetch = fetch
+
+    def run(self):
+        if self.navigation.cancelled:
+            return
+        try:
+            result = self.fetch(self.url, self.navigation)
+        except Exception as e:
+            result = ("", "", f"[WPYM-K] Failed to load {self.url}: {e}")
+        self.loader.finished.emit(self.navigation, self.callback, result)
+
+
+# Fetches documents and scripts on worker threads. Results are handed back to
+# the GUI thread through the queued finished signal and dropped if the
+# navigation they belong to was cancelled in the meantime.
+class PageLoader(QObject):
+    finished = pyqtSignal(object, object, object)
+
+    def __init__(self, fetch, max_threads: int = 4, parent=None):
+        super().__init__(parent)
+        self.fetch = fetch
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.finished.connect(self._deliver)
+
+    def load(self, navigation: Navigation, url: str, callback, fetch=None):
+        self.pool.start(
+            _FetchTask(self, navigation, url, callback, fetch or self.fetch)
+        )
+
+    def cancel(self, navigation: Navigation):
+        navigation.cancel()
+        self.pool.clear()
+
+    def _deliver(self, navigation: Navigation, callback, result):
+        if not navigation.cancelled:
+            callback(result)
+
+
+# Runs callables on the GUI thread for code that is not Qt-aware, such as
+# the fetch threads behind the scripts' fetch().
+class CallQueue(QObject):
+    posted = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.posted.connect(self._run)
+
+    def post(self, func):
+        self.posted.emit(func)
+
+    def _run(self, func):
+        func()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 5
+REGISTRY_URL = "https://gnuhobbyhub.de:8952/"
+BUNDLE_TYPE = "application/vnd.wpy.bundle+json"
+
+
+def cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "wpy-browser")
+
+
+# Writes a cache file through a temporary file next to it, so a reader never
+# sees a partial file. Errors are left to the caller.
+def atomic_write(path: str, data, mode: str = "wb"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, mode) as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+# One connection-pooled session shared by every network call the browser
+# makes. Connections are kept alive between requests and the number of
+# parallel connections per host is capped by pool_maxsize.
+class NetworkSession:
+    def __init__(
+        self,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        pool_connections: int = 16,
+        pool_maxsize: int = 6,
+        max_retries: int = 0,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=max_retries,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # gzip and deflate always, br and zstd when brotli or zstandard is
+        # installed; urllib3 decodes whatever the server picked.
+        self.session.headers["Accept-Encoding"] = urllib3.util.make_headers(
+            accept_encoding=True
+        )["accept-encoding"]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# What WPYS scripts see as `requests`. It mirrors the module's request
+# functions but every call goes through the browser's pooled session.
+class ScriptRequests:
+    exceptions = requests.exceptions
+    codes = requests.codes
+    Response = requests.Response
+    RequestException = requests.RequestException
+    HTTPError = requests.HTTPError
+    ConnectionError = requests.ConnectionError
+    Timeout = requests.Timeout
+
+    # warn is called once, on the first request, where blocking matters.
+    def __init__(self, network: NetworkSession, warn=None):
+        self._network = network
+        self._warn = warn
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self._warn is not None:
+            warn, self._warn = self._warn, None
+            warn(method, url)
+        return self._network.request(method, url, **kwargs)
+
+    def get(self, url: str, params=None, **kwargs) -> requests.Response:
+        return self.request("GET", url, params=params, **kwargs)
+
+    def options(self, url: str, **kwargs) -> requests.Response:
+        return self.request("OPTIONS", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url: str, data=None, json=None, **kwargs) -> requests.Response:
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+    def put(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request("PUT", url, data=data, **kwargs)
+
+    def patch(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, data=data, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+
+class WpyhResolutionError(Exception):
+    pass
+
+
+class _Lookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.address = None
+        self.error = None
+
+
+# Resolves .wpyh names through the registry. Answers are kept for ttl
+# seconds, unknown names for negative_ttl seconds, and the least recently
+# used entries are dropped beyond max_entries. Threads asking for a name
+# that is already being looked up wait for that lookup instead of sending
+# their own request. With a path the cache survives browser restarts.
+class WpyhResolver:
+    def __init__(
+        self,
+        network: NetworkSession,
+        registry: str = REGISTRY_URL,
+        ttl: float = 300,
+        negative_ttl: float = 30,
+        max_entries: int = 256,
+        path: str | None = None,
+    ):
+        self.network = network
+        self.registry = registry if registry.endswith("/") else registry + "/"
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lookups = {}
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def resolve(self, host: str) -> str:
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(host)
+                if entry[0] is None:
+                    raise WpyhResolutionError(f"Unknown wpyh host: {host}")
+                return entry[0]
+            lookup = self._lookups.get(host)
+            owner = lookup is None
+            if owner:
+                lookup = self._lookups[host] = _Lookup()
+
+        if not owner:
+            lookup.done.wait()
+        else:
+            try:
+                lookup.address = self._query(host)
+            except Exception as e:
+                lookup.error = e
+            finally:
+                with self._lock:
+                    del self._lookups[host]
+                    if lookup.error is None:
+                        self._store(host, lookup.address)
+                lookup.done.set()
+                if lookup.error is None and self.path:
+                    self._save()
+
+        if lookup.error is not None:
+            raise lookup.error
+        if lookup.address is None:
+            raise WpyhResolutionError(f"Unknown wpyh host: {host}")
+        return lookup.address
+
+    def invalidate(self, host: str | None = None):
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(host, None)
+        if self.path:
+            self._save()
+
+    def _query(self, host: str) -> str | None:
+        response = self.network.get(self.registry + host)
+        address = response.text.strip()
+        if response.status_code != 200 or not address:
+            return None
+        return address
+
+    def _store(self, host: str, address: str | None):
+        ttl = self.ttl if address is not None else self.negative_ttl
+        self._entries[host] = (address, time.time() + ttl)
+        self._entries.move_to_end(host)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for host, address, expires in entries:
+            if expires > now:
+                self._entries[host] = (address, expires)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        with self._lock:
+            entries = [
+                [host, address, expires]
+                for host, (address, expires) in self._entries.items()
+            ]
+        try:
+            atomic_write(self.path, json.dumps(entries), "w")
+        except OSError:
+            pass
+
+
+class CachedResponse:
+    def __init__(
+        self,
+        status_code: int,
+        url: str,
+        content: bytes,
+        encoding: str | None,
+        from_cache: bool = False,
+        content_type: str | None = None,
+    ):
+        self.status_code = status_code
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = from_cache
+        self.content_type = content_type
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+def _parse_cache_control(value: str) -> dict:
+    directives = {}
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+def _parse_http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+# Persistent HTTP cache for documents and scripts. Bodies are stored once
+# per sha256 digest under blobs/, the url index lives in index.json and the
+# least recently used entries are evicted beyond max_size bytes. Fresh
+# entries are served without touching the network, stale ones are
+# revalidated with If-None-Match / If-Modified-Since.
+class HttpCache:
+    def __init__(self, path: str, max_size: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self._index = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def fetch(
+        self,
+        network: NetworkSession,
+        url: str,
+        revalidate: bool = False,
+        cancelled=None,
+        headers: dict | None = None,
+    ) -> CachedResponse | None:
+        # Requests with different headers may get different representations
+        # of the same url (the server sends Vary), so they are cached apart.
+        key = url
+        if headers:
+            key += "".join(f"\n{name}: {headers[name]}" for name in sorted(headers))
+        entry, content = self._lookup(key)
+        if content is not None and not revalidate and entry["expires"] > time.time():
+            return self._cached(entry, content)
+
+        headers = dict(headers or {})
+        if content is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = network.get(url, headers=headers, stream=True)
+        try:
+            if response.status_code == 304 and content is not None:
+                self._refresh(key, response.headers)
+                return self._cached(entry, content)
+            chunks = []
+            for chunk in response.iter_content(65536):
+                if cancelled is not None and cancelled():
+                    return None
+                chunks.append(chunk)
+            content = b"".join(chunks)
+        finally:
+            response.close()
+
+        if response.status_code == 200:
+            self._store(key, response, content)
+        return CachedResponse(
+            response.status_code,
+            response.url,
+            content,
+            response.encoding,
+            content_type=response.headers.get("Content-Type"),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._save()
+        blobs = os.path.join(self.path, "blobs")
+        for name in os.listdir(blobs) if os.path.isdir(blobs) else ():
+            try:
+                os.remove(os.path.join(blobs, name))
+            except OSError:
+                pass
+
+    def _cached(self, entry: dict, content: bytes) -> CachedResponse:
+        return CachedResponse(
+            200,
+            entry["url"],
+            content,
+            entry["encoding"],
+            True,
+            entry.get("content_type"),
+        )
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, "blobs", digest)
+
+    def _lookup(self, key: str) -> tuple[dict | None, bytes | None]:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None, None
+            entry["accessed"] = time.time()
+            entry = dict(entry)
+        try:
+            with open(self._blob_path(entry["digest"]), "rb") as file:
+                return entry, file.read()
+        except OSError:
+            with self._lock:
+                self._index.pop(key, None)
+            return None, None
+
+    def _expires(self, headers) -> float:
+        directives = _parse_cache_control(headers.get("Cache-Control", ""))
+        if "no-cache" in directives:
+            return 0
+        now = time.time()
+        if "max-age" in directives:
+            try:
+                age = int(headers.get("Age", 0))
+                return now + int(directives["max-age"]) - age
+            except ValueError:
+                return 0
+        return _parse_http_date(headers.get("Expires")) or 0
+
+    def _refresh(self, key: str, headers):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return
+            entry["expires"] = self._expires(headers)
+            entry["etag"] = headers.get("ETag", entry["etag"])
+            entry["last_modified"] = headers.get(
+                "Last-Modified", entry["last_modified"]
+            )
+            self._save()
+
+    def _store(self, key: str, response, content: bytes):
+        directives = _parse_cache_control(response.headers.get("Cache-Control", ""))
+        if "no-store" in directives:
+            with self._lock:
+                if self._index.pop(key, None) is not None:
+                    self._save()
+            return
+
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        try:
+            if not os.path.exists(blob_path):
+                atomic_write(blob_path, content)
+        except OSError:
+            return
+
+        with self._lock:
+            self._index[key] = {
+                "url": response.url,
+                "digest": digest,
+                "size": len(content),
+                "encoding": response.encoding,
+                "content_type": response.headers.get("Content-Type"),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "expires": self._expires(response.headers),
+                "accessed": time.time(),
+            }
+            removed = self._evict()
+            self._save()
+        for digest in removed:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+
+    def _evict(self) -> set:
+        references = {}
+        for entry in self._index.values():
+            references[entry["digest"]] = references.get(entry["digest"], 0) + 1
+        total = sum(
+            entry["size"]
+            for entry in {e["digest"]: e for e in self._index.values()}.values()
+        )
+        removed = set()
+        for key, entry in sorted(
+            self._index.items(), key=lambda item: item[1]["accessed"]
+        ):
+            if total <= self.max_size:
+                break
+            del self._index[key]
+            references[entry["digest"]] -= 1
+            if not references[entry["digest"]]:
+                total -= entry["size"]
+                removed.add(entry["digest"])
+        return removed
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "index.json"), "r") as file:
+                self._index = json.load(file)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def _save(self):
+        try:
+            atomic_write(
+                os.path.join(self.path, "index.json"), json.dumps(self._index), "w"
+            )
+        except OSError:
+            pass
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+from collections import OrderedDict
+from PyQt6.QtCore import QObject
+
+WIDGET_COST = 4096
+SCRIPT_COST = 16384
+
+
+class PageEntry:
+    def __init__(
+        self,
+        url: str,
+        widget,
+        layout,
+        structure,
+        scripts: list,
+        script_globals: list,
+        title: str,
+        icon,
+        host=None,
+    ):
+        self.url = url
+        self.widget = widget
+        self.layout = layout
+        self.structure = structure
+        self.scripts = scripts
+        self.script_globals = script_globals
+        self.title = title
+        self.icon = icon
+        self.host = host
+        self.size = (
+            len(widget.findChildren(QObject)) * WIDGET_COST
+            + len(script_globals) * SCRIPT_COST
+        )
+
+    def discard(self):
+        self.widget.deleteLater()
+        if self.host is not None:
+            self.host.close()
+
+
+# Rendered pages of recent history entries, kept alive so back and forward
+# can swap them into the scroll area instead of loading them again. Bounded
+# by entry count and by an estimate of the memory the widget trees use.
+class PageCache:
+    def __init__(self, max_entries: int = 5, max_size: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def park(self, index: int, entry: PageEntry):
+        self.drop(index)
+        self._entries[index] = entry
+        size = sum(entry.size for entry in self._entries.values())
+        while self._entries and (
+            len(self._entries) > self.max_entries or size > self.max_size
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            size -= evicted.size
+            evicted.discard()
+
+    def take(self, index: int, url: str) -> PageEntry | None:
+        entry = self._entries.pop(index, None)
+        if entry is not None and entry.url != url:
+            entry.discard()
+            return None
+        return entry
+
+    def drop(self, index: int):
+        entry = self._entries.pop(index, None)
+        if entry is not None:
+            entry.discard()
+
+    def drop_from(self, index: int):
+        for key in [key for key in self._entries if key >= index]:
+            self.drop(key)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import bisect
+from PyQt6.QtCore import QEvent, QTimer
+from PyQt6.QtWidgets import QWidget
+
+ESTIMATED_HEIGHT = 30
+SPACING = 6
+MARGIN = 9
+
+
+# Page widget for very long documents. Only the root elements in or near the
+# viewport get real widgets; everything else stays an element record with an
+# estimated height until it is scrolled into range. Widgets that end up far
+# outside the viewport are released back into records. The page follows the
+# scroll area's scroll bar only while it is shown, since the bar stays with
+# the scroll area when the page is parked in the page cache.
+class VirtualPage(QWidget):
+    def __init__(
+        self,
+        scroll_area,
+        roots: list,
+        materialize,
+        release,
+        overscan: float = 1.0,
+        keep: float = 3.0,
+    ):
+        super().__init__()
+        self.scroll_area = scroll_area
+        self.roots = roots
+        self.materialize = materialize
+        self.release = release
+        self.overscan = overscan
+        self.keep = keep
+        self.heights = [ESTIMATED_HEIGHT] * len(roots)
+        self.offsets = []
+        self.widgets = {}
+        self.pending = False
+        self.following = False
+        self.update_offsets()
+
+    def update_offsets(self):
+        offsets = []
+        y = MARGIN
+        for height in self.heights:
+            offsets.append(y)
+            y += height + SPACING
+        self.offsets = offsets
+        self.setMinimumHeight(y - SPACING + MARGIN)
+
+    def schedule(self):
+        if not self.pending:
+            self.pending = True
+            QTimer.singleShot(0, self.update_view)
+
+    def event(self, event):
+        if event.type() == QEvent.Type.Show and not self.following:
+            self.scroll_area.verticalScrollBar().valueChanged.connect(self.schedule)
+            self.following = True
+        elif event.type() == QEvent.Type.Hide and self.following:
+            # The scroll area may be in the middle of being destroyed, which
+            # takes the connection with it.
+            try:
+                scroll_bar = self.scroll_area.verticalScrollBar()
+                scroll_bar.valueChanged.disconnect(self.schedule)
+            except RuntimeError:
+                pass
+            self.following = False
+        if event.type() in (
+            QEvent.Type.LayoutRequest,
+            QEvent.Type.Resize,
+            QEvent.Type.Show,
+        ):
+            self.schedule()
+        return super().event(event)
+
+    def measure(self, widget, width: int) -> int:
+        if widget.hasHeightForWidth():
+            return max(widget.heightForWidth(width), widget.minimumSizeHint().height())
+        return widget.sizeHint().height()
+
+    def update_view(self):
+        self.pending = False
+        if not self.following:
+            return
+        width = self.width() - 2 * MARGIN
+        top = self.scroll_area.verticalScrollBar().value()
+        view = self.scroll_area.viewport().height()
+
+        changed = False
+        for index, widget in self.widgets.items():
+            height = self.measure(widget, width)
+            if height != self.heights[index]:
+                self.heights[index] = height
+                changed = True
+
+        # Measured heights move the offsets below them, so repeat until the
+        # materialized range is stable.
+        for _ in range(4):
+            if changed:
+                self.update_offsets()
+                changed = False
+            start = top - view * self.overscan
+            end = top + view * (1 + self.overscan)
+            index = max(bisect.bisect_right(self.offsets, start) - 1, 0)
+            while index < len(self.roots) and self.offsets[index] < end:
+                if index not in self.widgets:
+                    widget = self.materialize(self.roots[index])
+                    widget.setParent(self)
+                    widget.show()
+                    self.widgets[index] = widget
+                    height = self.measure(widget, width)
+                    if height != self.heights[index]:
+                        self.heights[index] = height
+                        changed = True
+                index += 1
+            if not changed:
+                break
+
+        start = top - view * self.keep
+        end = top + view * (1 + self.keep)
+        for index in list(self.widgets):
+            if (
+                self.offsets[index] + self.heights[index] < start
+                or self.offsets[index] > end
+            ):
+                widget = self.widgets.pop(index)
+                self.release(self.roots[index])
+                widget.hide()
+                widget.deleteLater()
+
+        for index, widget in self.widgets.items():
+            widget.setGeometry(MARGIN, self.offsets[index], width, self.heights[index])
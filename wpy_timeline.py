@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QCheckBox,
+    QFileDialog,
+    QHBoxLayout,
+    QPlainTextEdit,
+    QPushButton,
+    QTabWidget,
+    QTreeWidget,
+    QTreeWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+
+# Timings of one navigation: resolving, fetching, executing and mounting the
+# markup, fetching and running scripts. Entries look like the web's
+# PerformanceEntry (name, entryType, startTime and duration in milliseconds
+# since the navigation started) and may be added from any thread.
+class Timeline:
+    def __init__(self, url: str = ""):
+        self.url = url
+        self.origin = time.perf_counter()
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, name: str, entry_type: str, start: float, end: float, detail=None):
+        entry = {
+            "name": name,
+            "entryType": entry_type,
+            "startTime": (start - self.origin) * 1000,
+            "duration": (end - start) * 1000,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(),
+            "detail": detail or {},
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    def mark(self, name: str, detail=None):
+        now = time.perf_counter()
+        self.add(name, "mark", now, now, detail)
+
+    # Yields a dict the caller can fill with details about the measured
+    # work, e.g. whether a response came from the cache.
+    @contextlib.contextmanager
+    def measure(self, name: str, entry_type: str, **detail):
+        start = time.perf_counter()
+        try:
+            yield detail
+        finally:
+            self.add(name, entry_type, start, time.perf_counter(), detail)
+
+    def entries(self, entry_type: str | None = None) -> list:
+        with self._lock:
+            entries = list(self._entries)
+        return [
+            {key: value for key, value in entry.items() if key != "tid"}
+            | {"detail": dict(entry["detail"])}
+            for entry in sorted(entries, key=lambda entry: entry["startTime"])
+            if entry_type is None or entry["entryType"] == entry_type
+        ]
+
+    # Chrome trace-event format, loadable in chrome://tracing or Perfetto.
+    def trace_events(self) -> dict:
+        with self._lock:
+            entries = list(self._entries)
+        pid = os.getpid()
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"WPY-Browser {self.url}"},
+            }
+        ]
+        threads = {}
+        for entry in entries:
+            threads[entry["tid"]] = entry["thread"]
+            event = {
+                "name": entry["name"],
+                "cat": entry["entryType"],
+                "ph": "X",
+                "ts": entry["startTime"] * 1000,
+                "dur": entry["duration"] * 1000,
+                "pid": pid,
+                "tid": entry["tid"],
+                "args": {key: str(value) for key, value in entry["detail"].items()},
+            }
+            if entry["entryType"] == "mark":
+                event.update(ph="i", s="t")
+                del event["dur"]
+            events.append(event)
+        for tid, name in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def measure(timeline: Timeline | None, name: str, entry_type: str, **detail):
+    if timeline is None:
+        return contextlib.nullcontext(detail)
+    return timeline.measure(name, entry_type, **detail)
+
+
+def profile_text(profiler, limit: int = 25) -> str:
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return output.getvalue()
+
+
+# Panel next to the console that lists the current navigation's timeline
+# and the watchdog's per-handler statistics. It polls both while visible,
+# since timeline entries arrive from the loader threads as well.
+class TimelinePanel(QWidget):
+    def __init__(self, parent, interval: int = 250):
+        super().__init__()
+        self.parent = parent
+        self.timeline = None
+        self.shown = -1
+        self.stats_version = -1
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Name", "Type", "Start (ms)", "Duration (ms)"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.currentItemChanged.connect(self.show_detail)
+        self.handlers = QTreeWidget()
+        self.handlers.setHeaderLabels(
+            ["Handler", "Script", "Page", "Calls", "Total (ms)", "Max (ms)", "Stopped"]
+        )
+        self.handlers.setRootIsDecorated(False)
+        self.tabs = QTabWidget()
+        self.tabs.addTab(self.tree, "Timeline")
+        self.tabs.addTab(self.handlers, "Handlers")
+        self.detail = QPlainTextEdit()
+        self.detail.setReadOnly(True)
+        self.detail.hide()
+        self.profile = QCheckBox("Profile scripts")
+        self.profile.setChecked(parent.profile_scripts)
+        self.profile.toggled.connect(
+            lambda checked: setattr(parent, "profile_scripts", checked)
+        )
+        self.export = QPushButton("Export trace")
+        self.export.clicked.connect(self.export_trace)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.profile)
+        buttons.addStretch()
+        buttons.addWidget(self.export)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.tabs)
+        layout.addWidget(self.detail)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+
+    def set_timeline(self, timeline: Timeline):
+        self.timeline = timeline
+        self.shown = -1
+        self.refresh()
+
+    def showEvent(self, event):
+        self.timer.start()
+        self.refresh()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        self.refresh_handlers()
+        if self.timeline is None or len(self.timeline) == self.shown:
+            return
+        entries = self.timeline.entries()
+        self.shown = len(entries)
+        self.tree.clear()
+        for entry in entries:
+            item = QTreeWidgetItem(
+                [
+                    entry["name"],
+                    entry["entryType"],
+                    f"{entry['startTime']:.1f}",
+                    f"{entry['duration']:.1f}",
+                ]
+            )
+            item.setData(0, Qt.ItemDataRole.UserRole, entry["detail"])
+            self.tree.addTopLevelItem(item)
+        for column in range(4):
+            self.tree.resizeColumnToContents(column)
+
+    def refresh_handlers(self):
+        watchdog = self.parent.watchdog
+        if watchdog.version == self.stats_version:
+            return
+        self.stats_version = watchdog.version
+        self.handlers.clear()
+        for (url, script, handler), stats in sorted(
+            watchdog.stats.items(), key=lambda item: -item[1].total
+        ):
+            self.handlers.addTopLevelItem(
+                QTreeWidgetItem(
+                    [
+                        handler,
+                        script,
+                        url,
+                        str(stats.count),
+                        f"{stats.total * 1000:.1f}",
+                        f"{stats.max * 1000:.1f}",
+                        str(stats.timeouts),
+                    ]
+                )
+            )
+        for column in range(7):
+            self.handlers.resizeColumnToContents(column)
+
+    def show_detail(self, item, previous=None):
+        detail = item.data(0, Qt.ItemDataRole.UserRole) if item is not None else None
+        if not detail:
+            self.detail.hide()
+            return
+        text = "\n".join(
+            f"{key}: {value}" for key, value in detail.items() if key != "profile"
+        )
+        if "profile" in detail:
+            text += "\n\n" + detail["profile"]
+        self.detail.setPlainText(text.strip())
+        self.detail.show()
+
+    def export_trace(self):
+        if self.timeline is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export trace", "trace.json", "Trace (*.json)"
+        )
+        if not path:
+            return
+        try:
+            with open(path, "w") as file:
+                json.dump(self.timeline.trace_events(), file)
+        except OSError as e:
+            self.parent.error(f"[WPYM-K] Failed to export trace: {e}")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import ctypes
+import sys
+import threading
+import time
+
+SCRIPT_BUDGET = 5.0
+HANDLER_BUDGET = 1.0
+
+
+# Raised inside a script that used up its CPU budget. It derives from
+# BaseException so that `except Exception` in the script cannot swallow it.
+class ScriptTimeout(BaseException):
+    pass
+
+
+# A ScriptTimeout that reaches Qt from a slot is not an error worth
+# aborting for; everything else goes to the default hook.
+def excepthook(exc_type, value, tb):
+    if not issubclass(exc_type, ScriptTimeout):
+        sys.__excepthook__(exc_type, value, tb)
+
+
+class HandlerStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+
+# Filename page scripts are compiled under, including code they exec(). Only
+# frames of that code are ever interrupted; stdlib code generated at runtime,
+# like namedtuple and dataclass methods, is "<string>" and runs in browser
+# code the scripts call.
+SCRIPT_FILENAME = "<wpys>"
+_PENDING_CALL = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+
+
+# Enforces CPU time budgets for script code running on the GUI thread, which
+# must be the main thread. A background thread polls the GUI thread's CPU
+# clock and, while a call is over budget, schedules a pending call on it.
+# That installs a trace function which raises ScriptTimeout at the next line
+# of script code, so browser code the script called into always finishes
+# and is never left half done. Pure Python loops stop while a blocking C call
+# finishes first. Without per-thread CPU clocks the budget is wall time.
+class Watchdog:
+    def __init__(
+        self,
+        script_budget: float = SCRIPT_BUDGET,
+        handler_budget: float = HANDLER_BUDGET,
+        interval: float = 0.05,
+    ):
+        self.script_budget = script_budget
+        self.handler_budget = handler_budget
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        try:
+            self.clock = time.pthread_getcpuclockid(self.thread_id)
+            time.clock_gettime(self.clock)
+        except (AttributeError, OSError):
+            self.clock = None
+        self.stats = {}
+        self.version = 0
+        self._deadline = 0.0
+        self._active = False
+        self._running = threading.Event()
+        self._pending = False
+        self._interrupt_call = _PENDING_CALL(self._interrupt)
+        self._thread = None
+
+    def cpu_time(self) -> float:
+        if self.clock is None:
+            return time.perf_counter()
+        return time.clock_gettime(self.clock)
+
+    # Runs func with a budget of `budget` seconds of CPU time and returns
+    # the time used and whether it was stopped. Other exceptions propagate.
+    # Nested calls, e.g. a handler triggered by setText in another handler,
+    # count against the outermost budget.
+    def call(self, budget: float, func) -> tuple[float, bool]:
+        start = self.cpu_time()
+        if self._active or budget <= 0:
+            try:
+                func()
+            except ScriptTimeout:
+                return self.cpu_time() - start, True
+            return self.cpu_time() - start, False
+
+        try:
+            timed_out = self._call(start + budget, func)
+        except ScriptTimeout:
+            timed_out = True
+        return self.cpu_time() - start, timed_out
+
+    def _call(self, deadline: float, func) -> bool:
+        timed_out = False
+        self._deadline = deadline
+        self._active = True
+        if not self._running.is_set():
+            self._running.set()
+        self._start()
+        try:
+            func()
+        except ScriptTimeout:
+            timed_out = True
+        finally:
+            # Only script frames raise, and none run after the call, so
+            # nothing reaches the code after it once the trace is gone.
+            self._active = False
+            if sys.gettrace() == self._trace:
+                sys.settrace(None)
+        return timed_out
+
+    def record(self, key: tuple, elapsed: float, timed_out: bool = False):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = HandlerStats()
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        stats.timeouts += timed_out
+        self.version += 1
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="wpys-watchdog", daemon=True
+            )
+            self._thread.start()
+
+    # Keeps interrupting while the call is over budget, in case the script
+    # or a nested call caught the previous ScriptTimeout. Raising from the
+    # trace function also removes it, so every interrupt installs it again.
+    # Once no call is active the thread sleeps until _call wakes it; a call
+    # that starts while it goes to sleep is seen by one of the two checks.
+    def _run(self):
+        while True:
+            self._running.wait()
+            time.sleep(self.interval)
+            if not self._active:
+                self._running.clear()
+                if self._active:
+                    self._running.set()
+                continue
+            if not self._pending and self.cpu_time() > self._deadline:
+                self._pending = True
+                # Fails while the interpreter's queue of pending calls is
+                # full; the next round tries again.
+                if ctypes.pythonapi.Py_AddPendingCall(self._interrupt_call, None):
+                    self._pending = False
+
+    # Runs on the GUI thread between two bytecodes of whatever it is
+    # executing. The script frames on the stack get the trace here, script
+    # frames called later get it from _trace. Opcode events are needed as
+    # well: a loop on a single line, like `while True: pass`, never starts
+    # a new line.
+    def _interrupt(self, arg) -> int:
+        self._pending = False
+        if not self._active or self.cpu_time() <= self._deadline:
+            return 0
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code.co_filename == SCRIPT_FILENAME:
+                frame.f_trace = self._stop
+                frame.f_trace_opcodes = True
+            frame = frame.f_back
+        sys.settrace(self._trace)
+        return 0
+
+    def _trace(self, frame, event: str, arg):
+        if frame.f_code.co_filename == SCRIPT_FILENAME:
+            frame.f_trace_opcodes = True
+            return self._stop
+        return None
+
+    def _stop(self, frame, event: str, arg):
+        if event in ("line", "opcode") and self._active:
+            raise ScriptTimeout
+        return self._stop
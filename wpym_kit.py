@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import traceback
 import os
-from PyQt6.QtCore import QByteArray
-from PyQt6.QtGui import QFont, QPixmap
+import wpy_pageview
+import wpy_timeline
+from PyQt6.QtGui import QFont
 from PyQt6.QtWidgets import (
     QFrame,
     QGroupBox,
@@ -15,7 +16,9 @@ from PyQt6.QtWidgets import (
     QWidget,
     QSizePolicy,
 )
-import requests
+
+ENGINE_VERSION = "wpym-1"
+VIRTUALIZE_THRESHOLD = 500
 
 
 # This is just to get a meta.[...] command
@@ -26,14 +29,11 @@ class meta:
     def setTitle(self, title):
         self.parent.navbar_title.setText(title)
 
+    def setPageCache(self, enabled):
+        self.parent.page_cacheable = enabled
+
     def setFavicon(self, url):
-        response = requests.get(self.parent.conv_wpy_url_to_http(url))
-        if response.status_code != 200:
-            print("Failed to download Favicon!")
-            return
-        pixmap = QPixmap()
-        pixmap.loadFromData(QByteArray(response.content))
-        self.parent.navbar_icon.setPixmap(pixmap)
+        self.parent.load_favicon(url)
 
 
 class engine:
@@ -43,7 +43,7 @@ class engine:
     def addScript(self, path):
         if path.startswith("/"):
             path = path.removeprefix("/")
-            self.parent.scripts.append(
+            self.parent.add_script(
                 self.parent.get_top_path(self.parent.history[self.parent.current_index])
                 + path
             )
@@ -52,111 +52,271 @@ class engine:
             or path.startswith("wpyps://")
             or path.startswith("file://")
         ):
-            self.parent.scripts.append(path)
+            self.parent.add_script(path)
         else:
-            self.parent.scripts.append(
+            self.parent.add_script(
                 os.path.split(self.parent.history[self.parent.current_index])[0]
                 + "/"
                 + path
             )
 
 
-def run_script(parent, script_name: str, script_content: str):
+def build_header(element, parent):
+    widget = QLabel(element["props"]["text"])
+    widget.setFont(QFont(widget.font().family(), element["props"]["size"]))
+    realize(element, widget)
+
+
+def build_paragraph(element, parent):
+    widget = QLabel(element["props"]["text"])
+    widget.setWordWrap(True)
+    realize(element, widget)
+
+
+def build_line_h(element, parent):
+    widget = QFrame()
+    widget.setFrameShape(QFrame.Shape.HLine)
+    widget.setLineWidth(3)
+    realize(element, widget)
+
+
+def build_text_input(element, parent):
+    widget = QLineEdit()
+    if element["props"]["password"]:
+        widget.setEchoMode(QLineEdit.EchoMode.Password)
+    widget.setPlaceholderText(element["props"]["placeholder"])
+    widget.setText(element["props"]["text"])
+    realize(element, widget)
+
+
+def build_button(element, parent):
+    widget = QPushButton(element["props"]["text"])
+    widget.setDisabled(element["props"]["disabled"])
+    realize(element, widget)
+
+
+def build_link(element, parent):
+    widget = QLabel(element["props"]["text"])
+    widget.mousePressEvent = lambda event: parent.navigate_to_rel(element["target"])
+    widget.setStyleSheet("text-decoration: underline; color: lightblue;")
+    realize(element, widget)
+
+
+def build_text_dropdown(element, parent):
+    widget = QComboBox()
+    widget.addItems(element["props"]["items"])
+    widget.setPlaceholderText(element["props"]["placeholder"])
+    if "current" in element["props"]:
+        widget.setCurrentIndex(element["props"]["current"])
+    realize(element, widget)
+
+
+def build_stretch(element, parent):
+    widget = QWidget()
+    widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+    realize(element, widget)
+
+
+def build_h_box(element, parent):
+    layout = QHBoxLayout()
+    for child in element["children"]:
+        attach(layout, child, parent)
+    element["layout"] = layout
+
+
+def build_group_box(element, parent):
+    widget = QGroupBox()
+    widget.setTitle(element["props"]["title"])
+    layout = QVBoxLayout()
+    widget.setLayout(layout)
+    for child in element["children"]:
+        attach(layout, child, parent)
+    element["layout"] = layout
+    realize(element, widget)
+
+
+def realize(element, widget):
+    element["widget"] = widget
+    element.pop("pending", None)
+    for signal, handler in element.get("handlers", ()):
+        getattr(widget, signal).connect(handler)
+
+
+# Runs an element's builder. One that fails, e.g. on a prop of the wrong type
+# from the markup, is reported and its element left out, so the rest of the
+# page still mounts.
+def build(element, parent) -> bool:
+    try:
+        element["build"](element, parent)
+        return True
+    except Exception:
+        tb = traceback.format_exc()
+        parent.console_sink.error(
+            f"[WPYM-K] Failed to render {element['type']} element:\n{tb}\n"
+        )
+        element.pop("widget", None)
+        element.pop("layout", None)
+        return False
+
+
+def attach(layout, element, parent):
+    if not build(element, parent):
+        return
+    if "widget" in element:
+        layout.addWidget(element["widget"])
+    else:
+        layout.addLayout(element["layout"])
+
+
+def materialize(element, parent) -> QWidget:
+    if not build(element, parent):
+        return QWidget()
+    if "widget" in element:
+        return element["widget"]
+    widget = QWidget()
+    element["layout"].setContentsMargins(0, 0, 0, 0)
+    widget.setLayout(element["layout"])
+    return widget
+
+
+# Turns a materialized element back into a record. State the user can change
+# through the widget is copied into the props first. Elements whose builder
+# failed have no widget.
+def release(element):
+    widget = element.pop("widget", None)
+    pending = element.pop("pending", ())
+    if widget is not None:
+        if element["type"] == "textInput" and "text" not in pending:
+            element["props"]["text"] = widget.text()
+        elif element["type"] == "textDropdown" and "items" not in pending:
+            element["props"]["current"] = widget.currentIndex()
+    element.pop("layout", None)
+    for child in element.get("children", ()):
+        release(child)
+
+
+# Creates the Qt widgets for a rendered element tree in one pass. The page
+# widget is filled while updates are suspended and only then handed to the
+# scroll area, so the visible page is laid out once. Long pages get a
+# VirtualPage that only materializes what is near the viewport.
+def mount(parent, roots: list):
+    if len(roots) > VIRTUALIZE_THRESHOLD:
+        parent.web_layout = None
+        parent.web_widget = wpy_pageview.VirtualPage(
+            parent.website,
+            roots,
+            lambda element: materialize(element, parent),
+            release,
+        )
+        parent.website.setWidget(parent.web_widget)
+        return
+
+    web_layout = QVBoxLayout()
+    web_widget = QWidget()
+    web_widget.setUpdatesEnabled(False)
+    web_widget.setLayout(web_layout)
+    for element in roots:
+        attach(web_layout, element, parent)
+    web_layout.addStretch()
+    web_widget.setUpdatesEnabled(True)
+
+    parent.web_layout = web_layout
+    parent.web_widget = web_widget
+    parent.website.setWidget(web_widget)
+
+
+def run_script(parent, script_name: str, script_content: str, timeline=None):
+    roots = {}
+
     def error(text):
-        for line in text.splitlines():
-            parent.console.append(
-                f'<span style="color: red">{str(line.replace(" ", "&nbsp;"))}</span>'
-            )
+        parent.console_sink.error(text)
 
-    def append_element(widget, id, type, append: dict = {}):
-        elementStr = {"widget": widget, "id": id, "type": type, **append}
+    def append_element(
+        id, type, build, props: dict | None = None, append: dict | None = None
+    ):
+        elementStr = {
+            "id": id,
+            "type": type,
+            "build": build,
+            "props": {} if props is None else props,
+            **(append or {}),
+        }
         parent.browser_structure.append(elementStr)
-        parent.web_layout.addWidget(widget)
+        roots[elementStr["seq"]] = elementStr
         return elementStr
 
-    def append_layout(layout, id, type):
-        elementStr = {"layout": layout, "id": id, "type": type}
-        parent.browser_structure.append(elementStr)
-        parent.web_layout.addLayout(layout)
-        return elementStr
+    # Containers take their children out of the page root instead of
+    # re-parenting widgets that were already inserted.
+    def adopt(content: list | tuple) -> list:
+        children = []
+        for element in content:
+            roots.pop(element.get("seq"), None)
+            children.append(element)
+        return children
 
     def header1(content="", id=""):
-        widget = QLabel(content)
-        widget.setFont(QFont(widget.font().family(), 24))
-        return append_element(widget, id, "header1")
+        return append_element(
+            id, "header1", build_header, {"text": content, "size": 24}
+        )
 
     def header2(content="", id=""):
-        widget = QLabel(content)
-        widget.setFont(QFont(widget.font().family(), 21))
-        return append_element(widget, id, "header2")
+        return append_element(
+            id, "header2", build_header, {"text": content, "size": 21}
+        )
 
     def header3(content="", id=""):
-        widget = QLabel(content)
-        widget.setFont(QFont(widget.font().family(), 18))
-        return append_element(widget, id, "header3")
+        return append_element(
+            id, "header3", build_header, {"text": content, "size": 18}
+        )
 
     def paragraph(content="", id=""):
-        widget = QLabel(content)
-        widget.setWordWrap(True)
-        return append_element(widget, id, "paragraph")
+        return append_element(id, "paragraph", build_paragraph, {"text": content})
 
     def line_h(id=""):
-        widget = QFrame()
-        widget.setFrameShape(QFrame.Shape.HLine)
-        widget.setLineWidth(3)
-        return append_element(widget, id, "lineH")
+        return append_element(id, "lineH", build_line_h)
 
     def text_input(placeholder="", id="", password=False):
-        widget = QLineEdit()
-        if password:
-            widget.setEchoMode(QLineEdit.EchoMode.Password)
-        widget.setPlaceholderText(placeholder)
-        return append_element(widget, id, "textInput")
+        return append_element(
+            id,
+            "textInput",
+            build_text_input,
+            {"text": "", "placeholder": placeholder, "password": password},
+        )
 
     def button(content="", disabled=False, id=""):
-        widget = QPushButton(content)
-        widget.setDisabled(disabled)
-        return append_element(widget, id, "button")
+        return append_element(
+            id, "button", build_button, {"text": content, "disabled": disabled}
+        )
 
     def link(content, target="", id=""):
-        widget = QLabel(content)
-        widget.mousePressEvent = lambda event: parent.navigate_to_rel(target)
-        widget.setStyleSheet("text-decoration: underline; color: lightblue;")
-        return append_element(widget, id, "header2", append={"target": target})
+        return append_element(
+            id, "header2", build_link, {"text": content}, append={"target": target}
+        )
 
     def text_dropdown(values=[], placeholder="", id=""):
-        widget = QComboBox()
-        widget.addItems(values)
-        widget.setPlaceholderText(placeholder)
-        return append_element(widget, id, "textDropdown")
+        return append_element(
+            id,
+            "textDropdown",
+            build_text_dropdown,
+            {"items": list(values), "placeholder": placeholder},
+        )
 
     def stretch(id=""):
-        widget = QWidget()
-        widget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        return append_element(widget, id, "stretch")
+        return append_element(id, "stretch", build_stretch)
 
     def h_box(content: list | tuple, id=""):
-        layout = QHBoxLayout()
-        for element in content:
-            if "layout" in element:
-                element["layout"].parent().removeItem(element["layout"])
-                layout.addLayout(element["layout"])
-            elif "widget" in element:
-                layout.addWidget(element["widget"])
-        return append_layout(layout, id, "vBox")
+        return append_element(
+            id, "vBox", build_h_box, append={"children": adopt(content)}
+        )
 
     def group_box(content: list | tuple, title="", id=""):
-        widget = QGroupBox()
-        widget.setTitle(title)
-        layout = QVBoxLayout()
-        widget.setLayout(layout)
-        for element in content:
-            if "layout" in element:
-                element["layout"].parent().removeItem(element["layout"])
-                layout.addLayout(element["layout"])
-            elif "widget" in element:
-                layout.addWidget(element["widget"])
-        return append_element(widget, id, "groupBox", append={"layout": layout})
+        return append_element(
+            id,
+            "groupBox",
+            build_group_box,
+            {"title": title},
+            append={"children": adopt(content)},
+        )
 
     restricted_globals = {
         "__builtins__": None,
@@ -177,8 +337,15 @@ def run_script(parent, script_name: str, script_content: str):
     }
 
     try:
-        exec(script_content, restricted_globals)
+        with wpy_timeline.measure(timeline, "compile", "wpym", script=script_name):
+            code = parent.code_cache.compile(script_content, ENGINE_VERSION)
+        with wpy_timeline.measure(timeline, "exec", "wpym", script=script_name):
+            exec(code, restricted_globals)
     except Exception:
         tb = traceback.format_exc()
         error(f"[WPYM-K] Failed to render {script_name}:\n{tb}\n")
         print("Exception occurred. Please check console")
+    finally:
+        with wpy_timeline.measure(timeline, "mount", "render") as detail:
+            mount(parent, list(roots.values()))
+            detail["elements"] = len(parent.browser_structure)
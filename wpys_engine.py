@@ -1,311 +1,439 @@
 #!/usr/bin/env python3
+import contextlib
 import traceback
-import re
-import json
 from typing import Text
 from PyQt6.QtWidgets import QLineEdit
-import requests
-import math
-import hashlib
-import base64
+import wpy_net
+import wpy_timeline
+from wpy_document import check_items, get_prop, listen
+from wpy_watchdog import SCRIPT_FILENAME
+from wpys_worker import (
+    BUILTINS,
+    MODULES,
+    ReadOnlyType,
+    handler_error,
+    sandbox_source,
+)
+import cProfile
+
+ENGINE_VERSION = "wpys-1"
+
+
+# Widget state that needs more than a single setter call, shared with
+# wpys_remote. Reads fall back to the props while a write is pending.
+def set_echo_mode(widget, password: bool):
+    if password:
+        widget.setEchoMode(QLineEdit.EchoMode.Password)
+    else:
+        widget.setEchoMode(QLineEdit.EchoMode.Normal)
 
 
-def is_math_expression(expr: str) -> bool:
-    return bool(re.search(r"^[\d \+\-\*\/\(\)%]*$", expr))
+def set_items(widget, items: list[str]):
+    widget.clear()
+    widget.addItems(items)
 
 
-class SandboxViolation(Exception):
-    pass
+def _widget(element: dict, prop: str):
+    if prop in element.get("pending", ()):
+        return None
+    return element.get("widget")
 
 
-class EngineLimitation(Exception):
-    pass
+def is_password(element: dict) -> bool:
+    widget = _widget(element, "password")
+    if widget is None:
+        return element["props"]["password"]
+    return widget.echoMode() == QLineEdit.EchoMode.Password
 
 
-def run_script(parent, script_name: str, script_content: str):
-    def _excepted_func_call(event_type: str, widget_type: str, func):
-        try:
-            func()
-        except Exception:
-            tb = traceback.format_exc().splitlines()
-            match = re.match(r"^  File \"[^\"]*\", line (\d*), in .*$", tb[-2])
-            line_number = "?"
-            if match:
-                line_number = match.group(0)
-            error(
-                f"[WPYS-E] Exception occured while processing event {event_type} in {widget_type} (at line {line_number}):\n{tb[-1]}\n"
-            )
+def is_enabled(element: dict) -> bool:
+    widget = _widget(element, "disabled")
+    if widget is None:
+        return not element["props"]["disabled"]
+    return widget.isEnabled()
 
-    class Element:
-        def __init__(self, element_json: dict):
-            self._Element__element_json = element_json
 
-        def id(self) -> str:
-            return self._Element__element_json["id"]
+def get_items(element: dict) -> list[str]:
+    widget = _widget(element, "items")
+    if widget is None:
+        return list(element["props"]["items"])
+    return [widget.itemText(index) for index in range(widget.count())]
 
-        def setId(self, id: str) -> None:
-            self._Element__element_json["id"] = id
 
-    class TextElement(Element):
-        def text(self) -> str:
-            return self._Element__element_json["widget"].text()
+def set_password(document, element: dict, password: bool):
+    document.mutations.set(element, "password", password, set_echo_mode)
 
-        def setText(self, text: str) -> None:
-            self._Element__element_json["widget"].setText(text)
 
-    class EventedTextElement(TextElement):
-        def __call__(self, func=None, *, event: str = ""):
-            if func is None:
+def replace_items(document, element: dict, items: list[str]):
+    element["props"].pop("current", None)
+    document.mutations.set(element, "items", check_items(items), set_items)
 
-                def wrapper(func):
-                    self._processEvent(event, func)
-                    return func
 
-                return wrapper
-            return func
+# What scripts get from getId() and friends. One wrapper exists per element
+# and page, bound to the page's ScriptContext; the sandbox rewrite keeps
+# scripts away from the _Element attributes.
+class Element(metaclass=ReadOnlyType):
+    __slots__ = ("_Element__element_json", "_Element__context")
 
-        def _processEvent(self, event, func):
-            pass
+    def __init__(self, element_json: dict, context):
+        self._Element__element_json = element_json
+        self._Element__context = context
 
-    class TextInput(EventedTextElement):
-        def _processEvent(self, event, func):
-            if event == "returnPressed":
-                self._Element__element_json["widget"].returnPressed.connect(
-                    lambda: _excepted_func_call(event, "TextInput", func)
-                )
-            elif event == "textChanged":
-                self._Element__element_json["widget"].textChanged.connect(
-                    lambda: _excepted_func_call(event, "TextInput", func)
-                )
-            else:
-                warning("[WPYS-E] Tried to assign invalid event type to TextInput.")
+    def id(self) -> str:
+        return self._Element__element_json["id"]
 
-        def placeholderText(self) -> str:
-            return self._Element__element_json["widget"].placeholderText()
+    def setId(self, id: str) -> None:
+        self._Element__context.document.set_id(self._Element__element_json, id)
 
-        def setPlaceholderText(self, placeholderText: str) -> None:
-            self._Element__element_json["widget"].setPlaceholderText(placeholderText)
 
-        def isPassword(self) -> bool:
-            return (
-                self._Element__element_json["widget"].echoMode()
-                == QLineEdit.EchoMode.Password
-            )
+class TextElement(Element):
+    __slots__ = ()
 
-        def setPassword(self, password: bool) -> None:
-            if password:
-                echo = QLineEdit.EchoMode.Password
-            else:
-                echo = QLineEdit.EchoMode.Normal
-            self._Element__element_json["widget"].setEchoMode(echo)
+    def text(self) -> str:
+        return get_prop(self._Element__element_json, "text", "text")
 
-    class Header1(TextElement):
-        pass
+    def setText(self, text: str) -> None:
+        self._Element__context.set(self._Element__element_json, "text", text, "setText")
 
-    class Header2(TextElement):
-        pass
 
-    class Header3(TextElement):
-        pass
+class EventedTextElement(TextElement):
+    __slots__ = ()
+    events = ()
 
-    class Paragraph(TextElement):
-        pass
+    def __call__(self, func=None, *, event: str = ""):
+        if func is None:
 
-    class Link(TextElement):
-        def target(self) -> str:
-            return self._Element__element_json["target"]
+            def wrapper(func):
+                self._processEvent(event, func)
+                return func
 
-        def setTarget(self, target: str):
-            self._Element__element_json["target"] = target
-            self._Element__element_json["widget"].mousePressEvent = (
-                lambda event: parent.navigate_to_rel(target)
+            return wrapper
+        return func
+
+    def _processEvent(self, event, func):
+        context = self._Element__context
+        if event in self.events:
+            context.listen(
+                self._Element__element_json, event, type(self).__name__, func
+            )
+        else:
+            context.parent.console_sink.warning(
+                f"[WPYS-E] Tried to assign invalid event type to {type(self).__name__} element."
             )
 
-    class Button(EventedTextElement):
-        def _processEvent(self, event, func):
-            if event == "clicked":
-                self._Element__element_json["widget"].clicked.connect(
-                    lambda: _excepted_func_call(event, "Button", func)
-                )
-            else:
-                warning(
-                    "[WPYS-E] Tried to assign invalid event type to Button element."
-                )
 
-        def isEnabled(self) -> bool:
-            return self._Element__element_json["widget"].isEnabled()
+class TextInput(EventedTextElement):
+    __slots__ = ()
+    events = ("returnPressed", "textChanged")
 
-        def setDisabled(self, disabled: bool) -> None:
-            self._Element__element_json["widget"].setDisabled(disabled)
+    def placeholderText(self) -> str:
+        return get_prop(self._Element__element_json, "placeholder", "placeholderText")
 
-    class TextDropdown(EventedTextElement):
-        def _processEvent(self, event, func):
-            if event == "activated":
-                self._Element__element_json["widget"].activated.connect(
-                    lambda: _excepted_func_call(event, "TextDropdown", func)
-                )
-            else:
-                warning(
-                    "[WPYS-E] Tried to assign invalid event type to TextDropdown element."
-                )
+    def setPlaceholderText(self, placeholderText: str) -> None:
+        self._Element__context.set(
+            self._Element__element_json,
+            "placeholder",
+            placeholderText,
+            "setPlaceholderText",
+        )
+
+    def isPassword(self) -> bool:
+        return is_password(self._Element__element_json)
+
+    def setPassword(self, password: bool) -> None:
+        set_password(
+            self._Element__context.document, self._Element__element_json, password
+        )
+
+
+class Header1(TextElement):
+    __slots__ = ()
+
+
+class Header2(TextElement):
+    __slots__ = ()
 
-        def placeholderText(self) -> str:
-            return self._Element__element_json["widget"].placeholderText()
 
-        def setPlaceholderText(self, placeholderText: str) -> None:
-            self._Element__element_json["widget"].setPlaceholderText(placeholderText)
+class Header3(TextElement):
+    __slots__ = ()
 
-        def items(self) -> list[str]:
-            return [
-                self._Element__element_json["widget"].itemText(index)
-                for index in range(self._Element__element_json["widget"].count())
-            ]
 
-        def setItems(self, items: list[str]) -> None:
-            self._Element__element_json["widget"].clear()
-            self._Element__element_json["widget"].addItems(items)
+class Paragraph(TextElement):
+    __slots__ = ()
 
-    class GroupBox(Element):
-        def title(self) -> str:
-            return self._Element__element_json["widget"].title()
 
-        def setTitle(self, title: str) -> None:
-            self._Element__element_json["widget"].setTitle(title)
+class Link(TextElement):
+    __slots__ = ()
 
-    def _print(*args, **kwargs):
-        raise EngineLimitation("Use log(), warn() or error() instead")
+    def target(self) -> str:
+        return self._Element__element_json["target"]
 
-    def _import(*args, **kwargs):
-        raise SandboxViolation("Importing modules is not allowed")
+    def setTarget(self, target: str):
+        self._Element__element_json["target"] = target
 
-    def _open(*args, **kwargs):
-        raise SandboxViolation(
-            "Opening files is not allowed. Use a upload form instead or download the file"
+
+class Button(EventedTextElement):
+    __slots__ = ()
+    events = ("clicked",)
+
+    def isEnabled(self) -> bool:
+        return is_enabled(self._Element__element_json)
+
+    def setDisabled(self, disabled: bool) -> None:
+        self._Element__context.set(
+            self._Element__element_json, "disabled", disabled, "setDisabled"
         )
 
-    def _exit():
-        raise EngineLimitation("Can't exit or quit a running script")
 
-    def log(text):
-        for line in text.splitlines():
-            parent.console.append(f"<span>{str(line).replace(' ', '&nbsp;')}</span>")
+class TextDropdown(EventedTextElement):
+    __slots__ = ()
+    events = ("activated",)
 
-    def warning(text):
-        for line in text.splitlines():
-            parent.console.append(
-                f'<span style="color: yellow">{str(line.replace(" ", "&nbsp;"))}</span>'
-            )
+    def placeholderText(self) -> str:
+        return get_prop(self._Element__element_json, "placeholder", "placeholderText")
 
-    def error(text):
-        for line in text.splitlines():
-            parent.console.append(
-                f'<span style="color: red">{str(line.replace(" ", "&nbsp;"))}</span>'
-            )
+    def setPlaceholderText(self, placeholderText: str) -> None:
+        self._Element__context.set(
+            self._Element__element_json,
+            "placeholder",
+            placeholderText,
+            "setPlaceholderText",
+        )
 
-    def _eval(expression):
-        if not isinstance(expression, str):
-            raise TypeError("eval() arg 1 must be a string")
-        if is_math_expression(expression):
-            restricted_globals = {"__builtins__": None}
-            restricted_locals = {}
-            return eval(expression, restricted_globals, restricted_locals)
-        else:
-            raise SandboxViolation("Eval can only process mathematical expressions")
+    def items(self) -> list[str]:
+        return get_items(self._Element__element_json)
 
-    def _exec(object: str, locals=None):
-        exec(object, restricted_globals, locals)
+    def setItems(self, items: list[str]) -> None:
+        replace_items(
+            self._Element__context.document, self._Element__element_json, items
+        )
 
-    def _input(prompt: str):
-        return parent.ask_question(script_name, prompt)
 
-    def _get_id(id: str):
-        element_json = None
-        for element in parent.browser_structure:
-            if element["id"] == id:
-                element_json = element
+class GroupBox(Element):
+    __slots__ = ()
 
-        if element_json:
-            return element_register[element_json["type"]](element_json)
+    def title(self) -> str:
+        return get_prop(self._Element__element_json, "title", "title")
 
-    def _get_ids(id: str):
-        return tuple(
-            element_register[element["type"]](element)
-            for element in parent.browser_structure
-            if element["id"] == id
+    def setTitle(self, title: str) -> None:
+        self._Element__context.set(
+            self._Element__element_json, "title", title, "setTitle"
+        )
+
+
+ELEMENTS = {
+    "header1": Header1,
+    "header2": Header2,
+    "header3": Header3,
+    "paragraph": Paragraph,
+    "button": Button,
+    "textInput": TextInput,
+    "link": Link,
+    "textDropdown": TextDropdown,
+    "groupBox": GroupBox,
+}
+
+
+# Script state shared by the scripts of one page: the element wrappers, the
+# builtins that need the page and the name of the script whose code is
+# running, for handlers, input() and the statistics. It lives on the page's
+# Document, so it is parked and restored with the page.
+class ScriptContext:
+    def __init__(self, parent, document):
+        self.parent = parent
+        self.document = document
+        self.url = parent.history[parent.current_index]
+        self.timeline = None
+        self.script_name = ""
+        self.wrappers = {}
+        self.builtins = BUILTINS | {
+            "log": parent.console_sink.log,
+            "warning": parent.console_sink.warning,
+            "error": parent.console_sink.error,
+            "input": self.input,
+            "getId": self.get_id,
+            "getIds": self.get_ids,
+            "getType": self.get_type,
+            "getTypes": self.get_types,
+            "navigateTo": parent.navigate_to_rel,
+            "currentHref": self.href,
+            "performanceEntries": self.performance_entries,
+            "fetch": self.fetch,
+            "batch": self.batch,
+            "convWPYPtoHTTP": parent.conv_wpy_url_to_http,
+        }
+
+    def wrap(self, element_json: dict | None):
+        if element_json is None:
+            return None
+        wrapper = self.wrappers.get(element_json["seq"])
+        if wrapper is None:
+            wrapper = ELEMENTS[element_json["type"]](element_json, self)
+            self.wrappers[element_json["seq"]] = wrapper
+        return wrapper
+
+    def turn(self):
+        return self.document.mutations.turn(
+            self.parent.web_widget, self.parent.console_sink.error
         )
 
-    def _get_type(element_type: str):
-        element_json = None
-        for element in parent.browser_structure:
-            if element["type"] == element_type:
-                element_json = element
+    def flush(self):
+        self.document.mutations.flush(
+            self.parent.web_widget, self.parent.console_sink.error
+        )
 
-        if element_json:
-            return element_register[element_json["type"]](element_json)
+    def set(self, element_json: dict, prop: str, value, setter: str):
+        self.document.mutations.set(element_json, prop, value, setter)
 
-    def _get_types(element_type: str):
+    def listen(self, element_json: dict, event: str, widget_type: str, func):
+        script_name = self.script_name
+        listen(
+            element_json,
+            event,
+            lambda: self.call(event, widget_type, script_name, func),
+        )
+
+    # Runs a handler or callback within the handler budget and reports what
+    # it raised to the console.
+    def call(self, event_type: str, widget_type: str, script_name: str, func):
+        previous, self.script_name = self.script_name, script_name
+        try:
+            with self.turn():
+                self._call(event_type, widget_type, script_name, func)
+        finally:
+            self.script_name = previous
+
+    def _call(self, event_type: str, widget_type: str, script_name: str, func):
+        watchdog = self.parent.watchdog
+        try:
+            elapsed, timed_out = watchdog.call(watchdog.handler_budget, func)
+            watchdog.record(
+                (self.url, script_name, f"{widget_type}.{event_type}"),
+                elapsed,
+                timed_out,
+            )
+            if timed_out:
+                self.parent.console_sink.error(
+                    f"[WPYS-E] Handler for event {event_type} in {widget_type} exceeded its CPU budget of {watchdog.handler_budget}s and was stopped.\n"
+                )
+        except Exception:
+            self.parent.console_sink.error(handler_error(event_type, widget_type))
+
+    def input(self, prompt: str):
+        self.flush()
+        return self.parent.ask_question(self.script_name, prompt)
+
+    # Groups writes like a script run does and applies them when the block
+    # ends, also in the middle of a script. Works as a decorator too.
+    @contextlib.contextmanager
+    def batch(self):
+        with self.turn():
+            yield
+        self.flush()
+
+    def get_id(self, id: str):
+        return self.wrap(self.document.last_by_id(id))
+
+    def get_ids(self, id: str):
+        return tuple(self.wrap(element) for element in self.document.by_id(id))
+
+    def get_type(self, element_type: str):
+        return self.wrap(self.document.last_by_type(element_type))
+
+    def get_types(self, element_type: str):
         return tuple(
-            element_register[element["type"]](element)
-            for element in parent.browser_structure
-            if element["type"] == element_type
+            self.wrap(element) for element in self.document.by_type(element_type)
         )
 
-    def _navigate_to(target: str):
-        parent.navigate_to_rel(target)
-
-    def _href():
-        return parent.history[parent.current_index]
-
-    element_register = {
-        "header1": Header1,
-        "header2": Header2,
-        "header3": Header3,
-        "paragraph": Paragraph,
-        "button": Button,
-        "textInput": TextInput,
-        "link": Link,
-        "textDropdown": TextDropdown,
-        "groupBox": GroupBox,
-    }
+    def href(self):
+        return self.parent.history[self.parent.current_index]
+
+    def fetch(self, url: str, method: str = "GET", **kwargs):
+        script_name = self.script_name
+        return self.parent.fetches.fetch(
+            lambda kind, func, *args: self.call(
+                kind, "fetch", script_name, lambda: func(*args)
+            ),
+            url,
+            method,
+            **kwargs,
+        )
+
+    def blocking_request(self, method: str, url: str):
+        self.parent.console_sink.warning(
+            f"[WPYS-E] {self.script_name} used requests.{method.lower()}({url!r}), which blocks the browser until the response arrives. Use fetch() instead.\n"
+        )
+
+    def performance_entries(self, entry_type: str | None = None):
+        if self.timeline is None:
+            return []
+        return self.timeline.entries(entry_type)
 
-    if __name__ == "__main__":
-        builtins_copy = __builtins__.__dict__.copy()
-    else:
-        builtins_copy = __builtins__.copy()
+
+def page_context(parent) -> ScriptContext:
+    document = parent.browser_structure
+    if document.script_context is None:
+        document.script_context = ScriptContext(parent, document)
+    return document.script_context
+
+
+def run_script(
+    parent, script_name: str, script_content: str, timeline=None, profile=False
+):
+    context = page_context(parent)
+    context.script_name = script_name
+    if timeline is not None:
+        context.timeline = timeline
+
+    def _exec(object: str, locals=None):
+        code = compile(sandbox_source(object), SCRIPT_FILENAME, "exec")
+        exec(code, restricted_globals, locals)
 
     restricted_globals = {
-        "__builtins__": builtins_copy,
-        "re": re,
-        "json": json,
-        "requests": requests,
-        "math": math,
-        "hashlib": hashlib,
-        "base64": base64,
+        "__builtins__": context.builtins | {"exec": _exec},
+        "requests": wpy_net.ScriptRequests(
+            parent.network, warn=context.blocking_request
+        ),
     }
+    restricted_globals.update(MODULES)
 
-    restricted_globals["__builtins__"]["__import__"] = _import
-    restricted_globals["__builtins__"]["print"] = _print
-    restricted_globals["__builtins__"]["open"] = _open
-    restricted_globals["__builtins__"]["exit"] = _exit
-    restricted_globals["__builtins__"]["quit"] = _exit
-    restricted_globals["__builtins__"]["log"] = log
-    restricted_globals["__builtins__"]["warning"] = warning
-    restricted_globals["__builtins__"]["error"] = error
-    restricted_globals["__builtins__"]["eval"] = _eval
-    restricted_globals["__builtins__"]["exec"] = _exec
-    restricted_globals["__builtins__"]["input"] = _input
-    restricted_globals["__builtins__"]["getId"] = _get_id
-    restricted_globals["__builtins__"]["getIds"] = _get_ids
-    restricted_globals["__builtins__"]["getType"] = _get_type
-    restricted_globals["__builtins__"]["getTypes"] = _get_types
-    restricted_globals["__builtins__"]["navigateTo"] = _navigate_to
-    restricted_globals["__builtins__"]["currentHref"] = _href
-    restricted_globals["__builtins__"]["convWPYPtoHTTP"] = parent.conv_wpy_url_to_http
-    del restricted_globals["__builtins__"]["getattr"]
-
+    profiler = cProfile.Profile() if profile else None
     try:
-        exec(script_content.replace("._Element", "."), restricted_globals)
+        with wpy_timeline.measure(timeline, "compile", "wpys", script=script_name):
+            code = parent.code_cache.compile(
+                script_content,
+                ENGINE_VERSION,
+                transform=sandbox_source,
+                filename=SCRIPT_FILENAME,
+            )
+
+        def execute():
+            try:
+                if profiler is not None:
+                    profiler.enable()
+                exec(code, restricted_globals)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+        span = wpy_timeline.measure(timeline, "exec", "wpys", script=script_name)
+        with span as detail, context.turn():
+            try:
+                _, timed_out = parent.watchdog.call(
+                    parent.watchdog.script_budget, execute
+                )
+            finally:
+                if profiler is not None:
+                    detail["profile"] = wpy_timeline.profile_text(profiler)
+        if timed_out:
+            parent.console_sink.error(
+                f"[WPYS-E] {script_name} exceeded its CPU budget of {parent.watchdog.script_budget}s and was stopped.\n"
+            )
     except Exception:
         tb = traceback.format_exc()
-        error(f"[WPYS-E] Exception occured in {script_name}:\n{tb}\n")
+        parent.console_sink.error(
+            f"[WPYS-E] Exception occured in {script_name}:\n{tb}\n"
+        )
         print("Exception occurred. Please check console")
+
+    return restricted_globals
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import time
+from PyQt6.QtCore import QObject, QSocketNotifier
+from wpy_document import get_prop, listen
+from wpys_engine import get_items, is_enabled, is_password, replace_items, set_password
+
+GETTERS = {("text", "text"), ("placeholder", "placeholderText"), ("title", "title")}
+SETTERS = {
+    ("text", "setText"),
+    ("placeholder", "setPlaceholderText"),
+    ("disabled", "setDisabled"),
+    ("title", "setTitle"),
+}
+EVENTS = {"clicked", "returnPressed", "textChanged", "activated"}
+
+
+# Browser side of a page whose scripts run in a wpys_worker process. It
+# applies the batched DOM operations the worker sends, answers its calls
+# and forwards widget events, all from a socket notifier on the GUI thread,
+# so the page stays responsive while scripts run.
+class ScriptHost(QObject):
+    def __init__(self, parent, pool, timeline=None):
+        super().__init__(parent)
+        self.browser = parent
+        self.pool = pool
+        self.timeline = timeline
+        self.document = parent.browser_structure
+        self.worker = pool.acquire()
+        self.started = []
+        self.closed = False
+        self.notifier = QSocketNotifier(
+            self.worker.conn.fileno(), QSocketNotifier.Type.Read, self
+        )
+        self.notifier.activated.connect(self.receive)
+        self.send(
+            (
+                "page",
+                parent.history[parent.current_index],
+                parent.watchdog.script_budget,
+                parent.watchdog.handler_budget,
+            )
+        )
+
+    def send(self, message: tuple):
+        if self.closed:
+            return
+        try:
+            self.worker.send(message)
+        except OSError:
+            self.crashed()
+
+    def run(self, script_name: str, script_content: str, profile: bool = False):
+        self.started.append((script_name, time.perf_counter()))
+        self.worker.pending += 1
+        self.send(("run", script_name, script_content, profile))
+
+    def forward(self, handler: int):
+        if not self.closed:
+            self.worker.pending += 1
+            self.send(("event", handler))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.notifier.setEnabled(False)
+        self.pool.release(self.worker)
+        self.deleteLater()
+
+    def crashed(self):
+        if self.closed:
+            return
+        self.browser.error("[WPYS-E] The script process of this page exited.\n")
+        self.worker.pending = 0
+        self.close()
+
+    def receive(self):
+        try:
+            while not self.closed and self.worker.conn.poll():
+                self.dispatch(self.worker.conn.recv())
+        except (EOFError, OSError):
+            self.crashed()
+
+    def dispatch(self, message: tuple):
+        kind = message[0]
+        if kind == "ops":
+            with self.document.mutations.turn(
+                self.browser.web_widget, self.browser.error
+            ):
+                for op in message[1]:
+                    try:
+                        getattr(self, "op_" + op[0])(*op[1:])
+                    except Exception as e:
+                        self.browser.error(
+                            f"[WPYS-E] Failed to apply {op[0]} from a script: {e}\n"
+                        )
+        elif kind == "call":
+            _, name, args = message
+            try:
+                reply = ("reply", getattr(self, "call_" + name)(*args))
+            except Exception as e:
+                reply = ("raise", f"{e.__class__.__name__}: {e}")
+            self.send(reply)
+        elif kind == "done":
+            _, script_name, detail = message
+            self.worker.pending -= 1
+            if script_name is not None and self.started:
+                name, start = self.started.pop(0)
+                if self.timeline is not None:
+                    self.timeline.add(name, "wpys", start, time.perf_counter(), detail)
+
+    def element(self, seq: int) -> dict:
+        return self.document[seq]
+
+    @staticmethod
+    def summary(element: dict | None):
+        if element is None:
+            return None
+        return element["seq"], element["type"]
+
+    def op_log(self, level: str, text: str):
+        self.browser.console_sink.write(level, text)
+
+    def op_set(self, seq: int, prop: str, value, setter: str):
+        if (prop, setter) not in SETTERS:
+            raise ValueError(f"{setter} is not allowed")
+        self.document.mutations.set(self.element(seq), prop, value, setter)
+
+    def op_setId(self, seq: int, id: str):
+        self.document.set_id(self.element(seq), id)
+
+    def op_setPassword(self, seq: int, password: bool):
+        set_password(self.document, self.element(seq), password)
+
+    def op_setItems(self, seq: int, items: list):
+        replace_items(self.document, self.element(seq), items)
+
+    def op_setTarget(self, seq: int, target: str):
+        self.element(seq)["target"] = target
+
+    def op_listen(self, seq: int, event: str, handler: int):
+        if event not in EVENTS:
+            raise ValueError(f"{event} is not an event")
+        listen(self.element(seq), event, lambda *args: self.forward(handler))
+
+    def op_navigate(self, target: str):
+        self.browser.navigate_to_rel(target)
+
+    def op_stats(self, key: tuple, elapsed: float, timed_out: bool):
+        self.browser.watchdog.record(tuple(key), elapsed, timed_out)
+
+    def call_getId(self, id: str):
+        return self.summary(self.document.last_by_id(id))
+
+    def call_getIds(self, id: str):
+        return [self.summary(element) for element in self.document.by_id(id)]
+
+    def call_getType(self, element_type: str):
+        return self.summary(self.document.last_by_type(element_type))
+
+    def call_getTypes(self, element_type: str):
+        return [self.summary(e) for e in self.document.by_type(element_type)]
+
+    def call_id(self, seq: int) -> str:
+        return self.element(seq)["id"]
+
+    def call_get(self, seq: int, prop: str, getter: str):
+        if (prop, getter) not in GETTERS:
+            raise ValueError(f"{getter} is not allowed")
+        return get_prop(self.element(seq), prop, getter)
+
+    def call_isPassword(self, seq: int) -> bool:
+        return is_password(self.element(seq))
+
+    def call_isEnabled(self, seq: int) -> bool:
+        return is_enabled(self.element(seq))
+
+    def call_items(self, seq: int) -> list:
+        return get_items(self.element(seq))
+
+    def call_target(self, seq: int) -> str:
+        return self.element(seq)["target"]
+
+    def call_input(self, script_name: str, prompt: str) -> str:
+        return self.browser.ask_question(script_name, prompt)
+
+    def call_performanceEntries(self, entry_type: str | None = None) -> list:
+        if self.timeline is None:
+            return []
+        return self.timeline.entries(entry_type)
+
+    def call_convWPYPtoHTTP(self, url: str) -> str:
+        return self.browser.conv_wpy_url_to_http(url)
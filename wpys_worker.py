@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+# Out-of-process WPYS execution. The worker side of this module runs page
+# scripts in a separate interpreter, so it must not import Qt: elements are
+# proxies that queue DOM operations and send them to the browser in batches,
+# and everything that needs an answer from the page is a synchronous call.
+# The sandbox helpers live here too, since wpys_engine imports Qt.
+import base64
+import builtins
+import cProfile
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import pstats
+import queue
+import re
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Connection
+import wpy_fetch
+import wpy_net
+from wpy_document import check_items, check_value
+from wpy_watchdog import SCRIPT_FILENAME, ScriptTimeout, Watchdog
+
+MAX_BATCH = 256
+
+
+def sandbox_source(script_content: str) -> str:
+    return script_content.replace("._Element", ".")
+
+
+def is_math_expression(expr: str) -> bool:
+    return bool(re.search(r"^[\d \+\-\*\/\(\)%]*$", expr))
+
+
+class SandboxViolation(Exception):
+    pass
+
+
+class EngineLimitation(Exception):
+    pass
+
+
+# Metaclass of the element classes handed to scripts. The classes are shared
+# by every page in the process, so scripts must not be able to change them.
+class ReadOnlyType(type):
+    def __setattr__(cls, name: str, value):
+        raise SandboxViolation(f"Cannot set {name} on {cls.__name__}")
+
+    def __delattr__(cls, name: str):
+        raise SandboxViolation(f"Cannot delete {name} from {cls.__name__}")
+
+
+def _print(*args, **kwargs):
+    raise EngineLimitation("Use log(), warn() or error() instead")
+
+
+def _import(*args, **kwargs):
+    raise SandboxViolation("Importing modules is not allowed")
+
+
+def _open(*args, **kwargs):
+    raise SandboxViolation(
+        "Opening files is not allowed. Use a upload form instead or download the file"
+    )
+
+
+def _exit():
+    raise EngineLimitation("Can't exit or quit a running script")
+
+
+def _eval(expression):
+    if not isinstance(expression, str):
+        raise TypeError("eval() arg 1 must be a string")
+    if is_math_expression(expression):
+        restricted_globals = {"__builtins__": None}
+        restricted_locals = {}
+        return eval(expression, restricted_globals, restricted_locals)
+    else:
+        raise SandboxViolation("Eval can only process mathematical expressions")
+
+
+# The parts of the restricted globals that are the same for every script,
+# built once. The pages of both engines add the functions that need them.
+BUILTINS = builtins.__dict__.copy()
+BUILTINS.update(
+    {
+        "__import__": _import,
+        "print": _print,
+        "open": _open,
+        "exit": _exit,
+        "quit": _exit,
+        "eval": _eval,
+    }
+)
+del BUILTINS["getattr"]
+MODULES = {"re": re, "json": json, "math": math, "hashlib": hashlib, "base64": base64}
+
+
+# The console message for an exception a handler raised, built in the except
+# block that caught it.
+def handler_error(event_type: str, widget_type: str) -> str:
+    tb = traceback.format_exc().splitlines()
+    match = re.match(r"^  File \"[^\"]*\", line (\d*), in .*$", tb[-2])
+    line_number = "?"
+    if match:
+        line_number = match.group(0)
+    return f"[WPYS-E] Exception occured while processing event {event_type} in {widget_type} (at line {line_number}):\n{tb[-1]}\n"
+
+
+class RemoteError(Exception):
+    pass
+
+
+# A started worker interpreter and its end of the socket pair.
+class Worker:
+    def __init__(self):
+        parent_socket, child_socket = socket.socketpair()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(child_socket.fileno())],
+            pass_fds=(child_socket.fileno(),),
+            close_fds=True,
+        )
+        child_socket.close()
+        self.conn = Connection(parent_socket.detach())
+        self.pid = self.process.pid
+        self.pending = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None and not self.conn.closed
+
+    def send(self, message: tuple):
+        self.conn.send(message)
+
+    def close(self):
+        if not self.conn.closed:
+            try:
+                self.conn.send(("exit",))
+            except OSError:
+                pass
+            self.conn.close()
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self.conn.close()
+
+
+# Worker processes handed out one per page. Released workers that are idle
+# are kept for the next page, and one is started ahead of time so a page
+# does not wait for an interpreter to start.
+class ScriptPool:
+    def __init__(self, max_idle: int = 2, prestart: int = 1):
+        self.max_idle = max_idle
+        self.prestart = prestart
+        self.idle = []
+        self.busy = set()
+
+    def acquire(self) -> Worker:
+        while self.idle:
+            worker = self.idle.pop()
+            if worker.alive():
+                break
+            worker.close()
+        else:
+            worker = Worker()
+        self.busy.add(worker)
+        while len(self.idle) < min(self.prestart, self.max_idle):
+            self.idle.append(Worker())
+        return worker
+
+    # A worker that is still running something of the old page is killed
+    # rather than reused, so nothing from that page reaches the next one.
+    def release(self, worker: Worker):
+        self.busy.discard(worker)
+        if worker.pending or not worker.alive():
+            worker.kill()
+        elif len(self.idle) < self.max_idle:
+            self.idle.append(worker)
+        else:
+            worker.close()
+
+    def close(self):
+        for worker in self.idle + list(self.busy):
+            worker.close()
+        self.idle.clear()
+        self.busy.clear()
+
+
+# Everything below runs in the worker process.
+
+
+# The scripts of one page inside a worker. The watchdog, the network
+# session and the fetch threads belong to the worker and outlive the page.
+# Fetch results come back through the inbox, so their callbacks run on the
+# worker's main thread like event handlers.
+class Page:
+    def __init__(
+        self,
+        conn,
+        inbox,
+        watchdog,
+        network,
+        fetcher,
+        url,
+        script_budget,
+        handler_budget,
+    ):
+        self.conn = conn
+        self.inbox = inbox
+        self.watchdog = watchdog
+        self.network = network
+        self.fetches = wpy_fetch.FetchGroup(
+            fetcher, lambda func: inbox.put(("post", func))
+        )
+        self.url = url
+        self.backlog = []
+        self.ops = []
+        self.handlers = []
+        self.elements = {}
+        self.script_name = ""
+        self.builtins = BUILTINS | {
+            "log": lambda text: self.log("log", text),
+            "warning": lambda text: self.log("warning", text),
+            "error": lambda text: self.log("error", text),
+            "input": self.input,
+            "getId": self.get_id,
+            "getIds": self.get_ids,
+            "getType": self.get_type,
+            "getTypes": self.get_types,
+            "navigateTo": lambda target: self.op("navigate", target),
+            "currentHref": lambda: self.url,
+            "performanceEntries": lambda entry_type=None: self.call(
+                "performanceEntries", entry_type
+            ),
+            "convWPYPtoHTTP": lambda url: self.call("convWPYPtoHTTP", url),
+            "fetch": self.fetch,
+            "batch": self.batch,
+        }
+        watchdog.script_budget = script_budget
+        watchdog.handler_budget = handler_budget
+
+    def op(self, *op):
+        self.ops.append(op)
+        if len(self.ops) >= MAX_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.ops:
+            self.conn.send(("ops", self.ops))
+            self.ops = []
+
+    # Round trip to the browser. Messages that arrive in the meantime (new
+    # events, scripts) are kept for the main loop.
+    def call(self, name: str, *args):
+        self.flush()
+        self.conn.send(("call", name, args))
+        while True:
+            message = self.inbox.get()
+            if message[0] == "reply":
+                return message[1]
+            if message[0] == "raise":
+                raise RemoteError(message[1])
+            if message[0] in ("exit", "eof"):
+                self.inbox.put(message)
+                raise EngineLimitation("The page was closed")
+            self.backlog.append(message)
+
+    def log(self, level: str, text):
+        self.op("log", level, str(text))
+
+    def element(self, summary):
+        if summary is None:
+            return None
+        seq, element_type = summary
+        element = self.elements.get(seq)
+        if element is None:
+            element = self.elements[seq] = ELEMENTS[element_type](self, seq)
+        return element
+
+    def run(self, script_name: str, script_content: str, profile: bool):
+        self.script_name = script_name
+
+        def _exec(object: str, locals=None):
+            code = compile(sandbox_source(object), SCRIPT_FILENAME, "exec")
+            exec(code, restricted_globals, locals)
+
+        restricted_globals = {
+            "__builtins__": self.builtins | {"exec": _exec},
+            "requests": wpy_net.ScriptRequests(self.network),
+        }
+        restricted_globals.update(MODULES)
+        profiler = cProfile.Profile() if profile else None
+
+        def execute():
+            try:
+                if profiler is not None:
+                    profiler.enable()
+                exec(code, restricted_globals)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+        elapsed = 0.0
+        try:
+            code = compile(sandbox_source(script_content), SCRIPT_FILENAME, "exec")
+            elapsed, timed_out = self.watchdog.call(
+                self.watchdog.script_budget, execute
+            )
+            if timed_out:
+                self.log(
+                    "error",
+                    f"[WPYS-E] {script_name} exceeded its CPU budget of {self.watchdog.script_budget}s and was stopped.\n",
+                )
+        except Exception:
+            tb = traceback.format_exc()
+            self.log("error", f"[WPYS-E] Exception occured in {script_name}:\n{tb}\n")
+        detail = {"process": os.getpid(), "cpu": elapsed}
+        if profiler is not None:
+            output = io.StringIO()
+            stats = pstats.Stats(profiler, stream=output)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(25)
+            detail["profile"] = output.getvalue()
+        self.flush()
+        self.conn.send(("done", script_name, detail))
+
+    def listen(self, seq: int, event: str, widget_type: str, script_name, func):
+        self.handlers.append((event, widget_type, script_name, func))
+        self.op("listen", seq, event, len(self.handlers) - 1)
+
+    def event(self, handler: int):
+        self.invoke(*self.handlers[handler])
+        self.conn.send(("done", None, None))
+
+    def invoke(self, event_type: str, widget_type: str, script_name: str, func):
+        self.script_name = script_name
+        try:
+            elapsed, timed_out = self.watchdog.call(self.watchdog.handler_budget, func)
+            self.op(
+                "stats",
+                (self.url, script_name, f"{widget_type}.{event_type}"),
+                elapsed,
+                timed_out,
+            )
+            if timed_out:
+                self.log(
+                    "error",
+                    f"[WPYS-E] Handler for event {event_type} in {widget_type} exceeded its CPU budget of {self.watchdog.handler_budget}s and was stopped.\n",
+                )
+        except Exception:
+            self.log("error", handler_error(event_type, widget_type))
+        self.flush()
+
+    def input(self, prompt: str):
+        return self.call("input", self.script_name, prompt)
+
+    def fetch(self, url: str, method: str = "GET", **kwargs):
+        script_name = self.script_name
+        return self.fetches.fetch(
+            lambda kind, func, *args: self.invoke(
+                kind, "fetch", script_name, lambda: func(*args)
+            ),
+            url,
+            method,
+            **kwargs,
+        )
+
+    # Sends the writes made so far as one batch when the block ends.
+    @contextlib.contextmanager
+    def batch(self):
+        yield
+        self.flush()
+
+    def get_id(self, id: str):
+        return self.element(self.call("getId", id))
+
+    def get_ids(self, id: str):
+        return tuple(self.element(summary) for summary in self.call("getIds", id))
+
+    def get_type(self, element_type: str):
+        return self.element(self.call("getType", element_type))
+
+    def get_types(self, element_type: str):
+        return tuple(
+            self.element(summary) for summary in self.call("getTypes", element_type)
+        )
+
+
+# Proxies for the page's elements. Reads are calls to the browser, writes
+# are queued operations.
+class Element(metaclass=ReadOnlyType):
+    def __init__(self, page: Page, seq: int):
+        self._Element__page = page
+        self._Element__seq = seq
+
+    def id(self) -> str:
+        return self._Element__page.call("id", self._Element__seq)
+
+    def setId(self, id: str) -> None:
+        self._Element__page.op("setId", self._Element__seq, id)
+
+    def _Element__get(self, prop: str, getter: str):
+        return self._Element__page.call("get", self._Element__seq, prop, getter)
+
+    def _Element__set(self, prop: str, value, setter: str):
+        check_value(setter, value)
+        self._Element__page.op("set", self._Element__seq, prop, value, setter)
+
+
+class TextElement(Element):
+    def text(self) -> str:
+        return self._Element__get("text", "text")
+
+    def setText(self, text: str) -> None:
+        self._Element__set("text", text, "setText")
+
+
+class EventedTextElement(TextElement):
+    events = ()
+
+    def __call__(self, func=None, *, event: str = ""):
+        if func is None:
+
+            def wrapper(func):
+                self._processEvent(event, func)
+                return func
+
+            return wrapper
+        return func
+
+    def _processEvent(self, event, func):
+        page = self._Element__page
+        if event in self.events:
+            page.listen(
+                self._Element__seq,
+                event,
+                type(self).__name__,
+                page.script_name,
+                func,
+            )
+        else:
+            page.log(
+                "warning",
+                f"[WPYS-E] Tried to assign invalid event type to {type(self).__name__} element.",
+            )
+
+
+class TextInput(EventedTextElement):
+    events = ("returnPressed", "textChanged")
+
+    def placeholderText(self) -> str:
+        return self._Element__get("placeholder", "placeholderText")
+
+    def setPlaceholderText(self, placeholderText: str) -> None:
+        self._Element__set("placeholder", placeholderText, "setPlaceholderText")
+
+    def isPassword(self) -> bool:
+        return self._Element__page.call("isPassword", self._Element__seq)
+
+    def setPassword(self, password: bool) -> None:
+        self._Element__page.op("setPassword", self._Element__seq, password)
+
+
+class Header1(TextElement):
+    pass
+
+
+class Header2(TextElement):
+    pass
+
+
+class Header3(TextElement):
+    pass
+
+
+class Paragraph(TextElement):
+    pass
+
+
+class Link(TextElement):
+    def target(self) -> str:
+        return self._Element__page.call("target", self._Element__seq)
+
+    def setTarget(self, target: str):
+        self._Element__page.op("setTarget", self._Element__seq, target)
+
+
+class Button(EventedTextElement):
+    events = ("clicked",)
+
+    def isEnabled(self) -> bool:
+        return self._Element__page.call("isEnabled", self._Element__seq)
+
+    def setDisabled(self, disabled: bool) -> None:
+        self._Element__set("disabled", disabled, "setDisabled")
+
+
+class TextDropdown(EventedTextElement):
+    events = ("activated",)
+
+    def placeholderText(self) -> str:
+        return self._Element__get("placeholder", "placeholderText")
+
+    def setPlaceholderText(self, placeholderText: str) -> None:
+        self._Element__set("placeholder", placeholderText, "setPlaceholderText")
+
+    def items(self) -> list[str]:
+        return self._Element__page.call("items", self._Element__seq)
+
+    def setItems(self, items: list[str]) -> None:
+        self._Element__page.op("setItems", self._Element__seq, check_items(items))
+
+
+class GroupBox(Element):
+    def title(self) -> str:
+        return self._Element__get("title", "title")
+
+    def setTitle(self, title: str) -> None:
+        self._Element__set("title", title, "setTitle")
+
+
+ELEMENTS = {
+    "header1": Header1,
+    "header2": Header2,
+    "header3": Header3,
+    "paragraph": Paragraph,
+    "button": Button,
+    "textInput": TextInput,
+    "link": Link,
+    "textDropdown": TextDropdown,
+    "groupBox": GroupBox,
+}
+
+
+# Reads messages as they arrive so the browser never blocks on a full
+# socket while this process is busy running a script.
+def read(conn, inbox):
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            inbox.put(("eof",))
+            return
+        inbox.put(message)
+        if message[0] == "exit":
+            return
+
+
+def serve(conn):
+    inbox = queue.Queue()
+    threading.Thread(target=read, args=(conn, inbox), daemon=True).start()
+    watchdog = Watchdog()
+    network = wpy_net.NetworkSession()
+    fetcher = wpy_fetch.Fetcher(network)
+    page = None
+    while True:
+        if page is not None and page.backlog:
+            message = page.backlog.pop(0)
+        else:
+            message = inbox.get()
+        kind = message[0]
+        try:
+            if kind == "page":
+                if page is not None:
+                    page.fetches.close()
+                page = Page(conn, inbox, watchdog, network, fetcher, *message[1:])
+            elif kind == "run":
+                page.run(*message[1:])
+            elif kind == "event":
+                page.event(*message[1:])
+            elif kind == "post":
+                message[1]()
+            elif kind in ("exit", "eof"):
+                return
+        except (OSError, ScriptTimeout):
+            return
+
+
+if __name__ == "__main__":
+    serve(Connection(int(sys.argv[1])))